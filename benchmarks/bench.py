@@ -0,0 +1,193 @@
+"""
+Offline end-to-end benchmark for the chat pipeline and the image commands.
+
+Drives main.on_message and the /imagine, /imagine-pollinations and /gif command callbacks with
+synthetic messages against local provider stubs, then reports throughput, reply latency
+percentiles and peak RSS. Run it from the repository root:
+
+    python -m benchmarks.bench --scenario chat --count 200 --concurrency 20
+    python -m benchmarks.bench --scenario imagine --latency prodia=1.5 --failure-rate prodia=0.05
+"""
+import argparse
+import asyncio
+import atexit
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.fakes import FakeChannel, FakeContext, FakeMessage, FakeUser
+from benchmarks.stubs import ProviderStubs, parse_provider_values
+
+PROMPTS = [
+    "what can you do?",
+    "how do I use /imagine",
+    "explain the difference between a list and a tuple in python",
+    "write a haiku about discord bots",
+    "what's the weather like on mars",
+    "summarize the plot of hamlet in two sentences",
+]
+
+
+def load_bot():
+    """
+    Imports main.py with a fake logged-in user so the handlers can run offline.
+
+    The settings database and the image job journal are kept in a temporary directory, so
+    a benchmark run neither touches the real settings.db and image_jobs.jsonl nor imports
+    a channels.txt lying in the working directory.
+    """
+    from utilities.config_loader import config
+
+    state_dir = tempfile.mkdtemp(prefix="bench-state-")
+    atexit.register(shutil.rmtree, state_dir, ignore_errors=True)
+    config['SETTINGS_DB'] = os.path.join(state_dir, "settings.db")
+    config['JOB_JOURNAL_FILE'] = os.path.join(state_dir, "image_jobs.jsonl")
+    from utilities import guild_settings
+    guild_settings.LEGACY_CHANNELS_FILE = os.path.join(state_dir, "channels.txt")
+    import main
+
+    main.bot._connection.user = FakeUser("Layla", bot=True)
+    return main
+
+
+async def close_bot(main):
+    """Closes the long-lived sessions main.py keeps, before the benchmark's event loop ends."""
+    await main.gif_prefetcher.close()
+    await main.attachment_reader.close()
+    await main.imagine_client.close()
+    await type(main.imagine_client).close_pool()
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_chat(main, count, concurrency, users):
+    channel = FakeChannel()
+    main.settings.active_channels.add(channel.id)
+    authors = [FakeUser(f"user{index}") for index in range(users)]
+    semaphore = asyncio.Semaphore(concurrency)
+    messages = []
+
+    async def send_one(index):
+        async with semaphore:
+            message = FakeMessage(random.choice(PROMPTS), author=authors[index % users], channel=channel)
+            messages.append(message)
+            await main.on_message(message)
+            # Replies are generated in the background, wait for this conversation to settle
+            await main.coalescer.wait_idle(f"{message.author.id}-{channel.id}")
+
+    await asyncio.gather(*(send_one(index) for index in range(count)), return_exceptions=True)
+    return [(message.created, message.first_reply_at) for message in messages]
+
+
+async def run_imagine(main, count, concurrency, users, command):
+    channel = FakeChannel()
+    authors = [FakeUser(f"user{index}") for index in range(users)]
+    semaphore = asyncio.Semaphore(concurrency)
+    contexts = []
+
+    async def invoke_one(index):
+        async with semaphore:
+            ctx = FakeContext(authors[index % users], channel)
+            contexts.append(ctx)
+            if command == "imagine":
+                await main.imagine.callback(ctx, random.choice(PROMPTS))
+            else:
+                await main.imagine_poly.callback(ctx, prompt=random.choice(PROMPTS), images=4)
+
+    await asyncio.gather(*(invoke_one(index) for index in range(count)), return_exceptions=True)
+    return [(ctx.created, ctx.first_reply_at) for ctx in contexts]
+
+
+async def run_gif(main, count, concurrency, users):
+    from discord import app_commands
+
+    channel = FakeChannel()
+    authors = [FakeUser(f"user{index}") for index in range(users)]
+    semaphore = asyncio.Semaphore(concurrency)
+    contexts = []
+    main.gif_prefetcher.start()
+    await main.gif_prefetcher.wait_filled()
+
+    async def invoke_one(index):
+        async with semaphore:
+            ctx = FakeContext(authors[index % users], channel)
+            contexts.append(ctx)
+            category = random.choice(main.gif_categories)
+            await main.gif.callback(ctx, app_commands.Choice(name=category, value=category))
+
+    await asyncio.gather(*(invoke_one(index) for index in range(count)), return_exceptions=True)
+    return [(ctx.created, ctx.first_reply_at) for ctx in contexts]
+
+
+def report(scenario, timings, elapsed, stub_stats, rest_status):
+    latencies = [(replied - created) * 1000 for created, replied in timings if replied is not None]
+    print(f"\nScenario: {scenario}")
+    print(f"  Requests:        {len(timings)} ({len(timings) - len(latencies)} without a reply of their own, "
+          f"i.e. coalesced into a later message or failed)")
+    print(f"  Wall time:       {elapsed:.2f} s")
+    print(f"  Throughput:      {len(latencies) / elapsed:.2f} replies/s")
+    print(f"  Reply latency:   p50 {percentile(latencies, 0.50):.0f} ms | "
+          f"p95 {percentile(latencies, 0.95):.0f} ms | p99 {percentile(latencies, 0.99):.0f} ms")
+    print(f"  Peak RSS:        {peak_rss_mb():.1f} MB")
+    print(f"  Discord REST:    {rest_status}")
+    print("  Provider stubs:")
+    for provider, stats in stub_stats.items():
+        if stats["requests"]:
+            print(f"    {provider:<13} requests {stats['requests']:<6} failures {stats['failures']:<5} "
+                  f"peak in flight {stats['peak_in_flight']}")
+
+
+async def run(args):
+    stubs = ProviderStubs(parse_provider_values(args.latency), parse_provider_values(args.failure_rate),
+                          args.image_size)
+    stubs.start()
+    try:
+        stubs.point_bot_at_stubs()
+        main = load_bot()
+        started = time.perf_counter()
+        if args.scenario == "chat":
+            timings = await run_chat(main, args.count, args.concurrency, args.users)
+        elif args.scenario == "gif":
+            timings = await run_gif(main, args.count, args.concurrency, args.users)
+        else:
+            timings = await run_imagine(main, args.count, args.concurrency, args.users, args.scenario)
+        elapsed = time.perf_counter() - started
+        async with aiohttp.ClientSession() as session:
+            stub_stats = await stubs.fetch_stats(session)
+        report(args.scenario, timings, elapsed, stub_stats, main.rest_budget.status())
+        await close_bot(main)
+    finally:
+        stubs.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["chat", "imagine", "imagine-pollinations", "gif"], default="chat")
+    parser.add_argument("--count", type=int, default=100, help="Number of messages or commands to send")
+    parser.add_argument("--concurrency", type=int, default=10, help="Maximum requests in flight")
+    parser.add_argument("--users", type=int, default=10, help="Number of distinct synthetic authors")
+    parser.add_argument("--image-size", type=int, default=256, help="Width and height of stub images")
+    parser.add_argument("--latency", action="append", metavar="PROVIDER=SECONDS",
+                        help="Stub latency override, e.g. chat=1.2 (repeatable)")
+    parser.add_argument("--failure-rate", action="append", metavar="PROVIDER=RATE",
+                        help="Stub failure rate override, e.g. search=0.1 (repeatable)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
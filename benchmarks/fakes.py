@@ -0,0 +1,121 @@
+"""
+Synthetic stand-ins for the discord.py objects the bot's handlers touch.
+
+Only the attributes and coroutines used by main.py are implemented. Every outgoing
+call is recorded with a timestamp so the benchmarks can measure reply latency.
+"""
+import itertools
+import time
+
+_ids = itertools.count(10**17)
+
+# Where FakeAttachment URLs point, the provider stubs serve attachment bodies under it
+CDN_URL = "https://cdn.example.com"
+
+
+class FakeUser:
+    def __init__(self, name, bot=False):
+        self.id = next(_ids)
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+
+    def mentioned_in(self, message):
+        return any(mention.id == self.id for mention in message.mentions)
+
+
+class FakeTyping:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def __aenter__(self):
+        self.channel.calls.append(("typing", time.perf_counter()))
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeChannel:
+    def __init__(self, name="bench"):
+        self.id = next(_ids)
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.calls = []
+
+    def typing(self):
+        return FakeTyping(self)
+
+    async def send(self, content=None, **kwargs):
+        self.calls.append(("send", time.perf_counter()))
+        return FakeMessage(content or "", author=None, channel=self)
+
+
+class FakeAttachment:
+    def __init__(self, filename, data, content_type="text/plain"):
+        self.id = next(_ids)
+        self.filename = filename
+        self.size = len(data)
+        self.content_type = content_type
+        self.url = f"{CDN_URL}/{self.id}/{filename}?size={self.size}"
+        self._data = data
+
+    async def read(self):
+        return self._data
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel, attachments=None, mentions=None):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = None
+        self.attachments = attachments or []
+        self.mentions = mentions or []
+        self.stickers = []
+        self.embeds = []
+        self.reference = None
+        self.mention_everyone = False
+        self.created = time.perf_counter()
+        self.first_reply_at = None
+        self.replies = []
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def remove_reaction(self, emoji, member):
+        if emoji in self.reactions:
+            self.reactions.remove(emoji)
+
+    async def reply(self, content=None, **kwargs):
+        if self.first_reply_at is None:
+            self.first_reply_at = time.perf_counter()
+        self.replies.append(content)
+        return FakeMessage(content or "", author=None, channel=self.channel)
+
+    async def delete(self):
+        pass
+
+
+class FakeContext:
+    """Minimal commands.Context for invoking hybrid command callbacks directly."""
+
+    def __init__(self, author, channel, guild=None):
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.interaction = None
+        self.created = time.perf_counter()
+        self.first_reply_at = None
+        self.sent = []
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send(self, content=None, **kwargs):
+        if self.first_reply_at is None:
+            self.first_reply_at = time.perf_counter()
+        self.sent.append((content, kwargs))
+        return FakeMessage(content or "", author=None, channel=self.channel)
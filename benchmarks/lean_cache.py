@@ -0,0 +1,102 @@
+"""
+Compares the memory the discord.py caches take with and without LEAN_CACHE.
+
+A synthetic large guild is loaded into the bot's connection state the way the gateway
+would deliver it for each set of intents: with the members intent the whole member
+list arrives (GUILD_CREATE plus chunking), with presences a presence for every online
+member. In lean mode only the bot's own member is sent. Memory is measured with
+tracemalloc, so only what the caches hold is counted:
+
+    python -m benchmarks.lean_cache --guilds 5 --members 50000
+"""
+import argparse
+import gc
+import tracemalloc
+
+from discord.ext import commands
+
+from benchmarks.fakes import FakeUser
+from utilities.discord_util import bot_options
+
+BOT_USER = FakeUser("Layla", bot=True)
+BOT_ID = BOT_USER.id
+
+
+def member_payload(user_id):
+    return {
+        "user": {"id": str(user_id), "username": f"member{user_id}", "discriminator": "0",
+                 "global_name": f"Member {user_id}", "avatar": None},
+        "nick": None,
+        "roles": [],
+        "joined_at": "2023-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+def guild_payload(guild_id, members, online_share, intents):
+    member_ids = range(guild_id * 10**7, guild_id * 10**7 + members)
+    payload = {
+        "id": str(guild_id),
+        "name": f"Guild {guild_id}",
+        "owner_id": str(member_ids[0]),
+        "member_count": members + 1,
+        "large": True,
+        "channels": [{"id": str(guild_id * 1000 + index), "type": 0, "name": f"channel-{index}", "position": index,
+                      "permission_overwrites": []} for index in range(50)],
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "members": [member_payload(BOT_ID)],
+        "presences": [],
+    }
+    if intents.members:
+        payload["members"] += [member_payload(user_id) for user_id in member_ids]
+    if intents.presences:
+        payload["presences"] = [{"user": {"id": str(user_id)}, "status": "online", "client_status": {"desktop": "online"},
+                                 "activities": [{"name": "Minecraft", "type": 0}]}
+                                for user_id in member_ids[:int(members * online_share)]]
+    return payload
+
+
+def measure(lean, guilds, members, online_share):
+    options = bot_options(lean)
+    bot = commands.Bot(command_prefix="/", **options)
+    state = bot._connection
+    state.user = BOT_USER
+    payloads = [guild_payload(guild_id, members, online_share, options["intents"]) for guild_id in range(1, guilds + 1)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for payload in payloads:
+        state._add_guild_from_data(payload)
+    del payloads
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    cached_members = sum(len(guild.members) for guild in bot.guilds)
+    return held, cached_members, options
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--members", type=int, default=20000, help="Members per guild")
+    parser.add_argument("--online-share", type=float, default=0.3, help="Share of members with a presence")
+    args = parser.parse_args()
+
+    print(f"Fixture: {args.guilds} guilds x {args.members} members, {args.online_share:.0%} online\n")
+    results = {}
+    for lean in (False, True):
+        held, cached_members, options = measure(lean, args.guilds, args.members, args.online_share)
+        results[lean] = held
+        intents = options["intents"]
+        print(f"  {'LEAN_CACHE' if lean else 'default':<11} {held / 2**20:8.1f} MB held by caches, "
+              f"{cached_members} members cached, members intent {intents.members}, "
+              f"presences intent {intents.presences}, typing intent {intents.typing}")
+    if results[True]:
+        print(f"\n  Lean mode holds {results[False] / results[True]:.0f}x less memory.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Measures the throughput of the image prompt filter.
+
+Screens a synthetic mix of clean and obfuscated prompts with the BLACKLIST_WORDS from
+config.yml and reports prompts per second and the time per prompt, with and without
+the local NSFW classifier. Ordinary prompts that look like a blocked word are screened
+first, and any of them that is rejected is reported as a false positive:
+
+    python -m benchmarks.prompt_filter --count 100000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.bench import percentile
+from utilities.prompt_filter import PromptFilter, blacklisted_words
+
+CLEAN = [
+    "a cozy cabin in the snowy mountains at dusk, oil painting",
+    "cyberpunk city street at night with neon signs and rain",
+    "portrait of an astronaut cat, studio lighting, 85mm",
+    "watercolor of the essex coast with sailing boats",
+    "isometric pixel art of a tiny wizard tower",
+]
+# Ordinary prompts that must pass: words that only line up with a blocked one across a
+# word boundary, and everyday words the classifier must not add up
+FALSE_POSITIVES = [
+    "Tom's ex",
+    "5 ex-boyfriends",
+    "lol i want a cat",
+    "an adult golden retriever",
+    "a girl and a woman in bed",
+    "portrait of a woman, full body, bikini",
+    "a man singing in the shower, cartoon",
+]
+OBFUSCATIONS = [
+    lambda word: word.upper(),
+    lambda word: " ".join(word),
+    lambda word: ".".join(word),
+    lambda word: word.replace("e", "3").replace("a", "4").replace("o", "0").replace("i", "1"),
+    lambda word: word[0] + "\u200b" + word[1:],
+    lambda word: word + word[-1] * 3,
+]
+
+
+def make_prompts(count, blocked_share, seed=0):
+    rng = random.Random(seed)
+    words = [word for word in blacklisted_words if word.strip()] or ["blocked"]
+    prompts = []
+    for _ in range(count):
+        prompt = rng.choice(CLEAN)
+        if rng.random() < blocked_share:
+            word = rng.choice(OBFUSCATIONS)(rng.choice(words).lower())
+            prompt = f"{prompt}, {word}"
+        prompts.append(prompt)
+    return prompts
+
+
+def run(prompt_filter, prompts):
+    timings = []
+    rejected = 0
+    started = time.perf_counter()
+    for prompt in prompts:
+        before = time.perf_counter()
+        rejected += prompt_filter.check(prompt) is not None
+        timings.append(time.perf_counter() - before)
+    return time.perf_counter() - started, timings, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50000, help="Number of prompts to screen")
+    parser.add_argument("--blocked-share", type=float, default=0.2, help="Share of prompts with a blocked word")
+    args = parser.parse_args()
+
+    false_positives = [(prompt, reason) for prompt in FALSE_POSITIVES
+                       for reason in [PromptFilter(classifier=True).check(prompt)] if reason is not None]
+    for prompt, reason in false_positives:
+        print(f"\033[33mFalse positive: {prompt!r} was rejected, {reason}\033[0m")
+    print(f"{len(FALSE_POSITIVES) - len(false_positives)}/{len(FALSE_POSITIVES)} ordinary prompts passed\n")
+
+    prompts = make_prompts(args.count, args.blocked_share)
+    print(f"{args.count} prompts, {args.blocked_share:.0%} with an obfuscated blocked word, "
+          f"{len(blacklisted_words)} words in the blocklist\n")
+    for classifier in (False, True):
+        elapsed, timings, rejected = run(PromptFilter(classifier=classifier), prompts)
+        micros = [timing * 1e6 for timing in timings]
+        print(f"  {'blocklist + classifier' if classifier else 'blocklist':<23} {args.count / elapsed:>10.0f} prompts/s | "
+              f"p50 {percentile(micros, 0.5):.1f} us | p99 {percentile(micros, 0.99):.1f} us | {rejected} rejected")
+
+
+if __name__ == "__main__":
+    main()
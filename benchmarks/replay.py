@@ -0,0 +1,232 @@
+"""
+Re-drives a captured traffic trace against the bot with stubbed providers.
+
+The trace comes from TRAFFIC_CAPTURE (see config.yml). Events are replayed at their
+recorded offsets divided by --speed, so --speed 10 plays back ten times the real load.
+Every pipeline stage is timed, and the report shows where queueing starts and which
+stage saturates first:
+
+    python -m benchmarks.replay traffic.jsonl --speed 10
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import functools
+import time
+
+import aiohttp
+
+from benchmarks.bench import close_bot, load_bot, peak_rss_mb, percentile
+from benchmarks.fakes import FakeAttachment, FakeChannel, FakeContext, FakeMessage, FakeUser
+from benchmarks.stubs import ProviderStubs, parse_provider_values
+from utilities.traffic_capture import load_trace
+
+# Stage name -> attribute of main.py that implements it
+STAGES = {
+    "search": "search",
+    "generate": "generate_response",
+    "prodia": "generate_image",
+    "pollinations": "poly_image_gen",
+}
+SATURATION_FACTOR = 2.0
+
+
+class StageRecorder:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.samples = collections.defaultdict(list)
+        self.in_flight = collections.Counter()
+        self.peak_in_flight = collections.Counter()
+
+    def record(self, stage, start, duration):
+        self.samples[stage].append((start - self.started, duration))
+
+    @contextlib.contextmanager
+    def active(self, stage):
+        """Counts the stage as in flight, for its peak concurrency."""
+        self.in_flight[stage] += 1
+        self.peak_in_flight[stage] = max(self.peak_in_flight[stage], self.in_flight[stage])
+        try:
+            yield
+        finally:
+            self.in_flight[stage] -= 1
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with self.active(stage):
+                    return await func(*args, **kwargs)
+            finally:
+                self.record(stage, start, time.perf_counter() - start)
+        return wrapper
+
+    def instrument(self, main):
+        for stage, attribute in STAGES.items():
+            setattr(main, attribute, self.wrap(stage, getattr(main, attribute)))
+
+
+def find_saturation(samples, windows):
+    """Splits samples into time windows and returns (baseline p50, first window whose p50 doubled)."""
+    if not samples:
+        return None, None
+    end = max(start for start, _ in samples) or 1.0
+    buckets = collections.defaultdict(list)
+    for start, duration in samples:
+        buckets[min(windows - 1, int(start / end * windows))].append(duration)
+    medians = [(index * end / windows, percentile(buckets[index], 0.5)) for index in sorted(buckets)]
+    baseline = medians[0][1]
+    for window_start, median in medians[1:]:
+        if median > baseline * SATURATION_FACTOR:
+            return baseline, window_start
+    return baseline, None
+
+
+class TraceReplayer:
+    def __init__(self, main, trace, speed, recorder):
+        self.main = main
+        self.trace = trace
+        self.speed = speed
+        self.recorder = recorder
+        self.channels = {}
+        self.users = {}
+        self.replies = []
+        self.skipped = collections.Counter()
+        active = {event["c"] for event in trace if event["k"] == "m" and event.get("g") == "active"}
+        self.active_channels = active
+        self.trigger_word = main.trigger_words[0] if main.trigger_words else main.bot.user.name
+
+    def channel(self, key):
+        if key not in self.channels:
+            self.channels[key] = FakeChannel(key)
+            if key in self.active_channels:
+                self.main.settings.active_channels.add(self.channels[key].id)
+        return self.channels[key]
+
+    def user(self, key):
+        if key not in self.users:
+            self.users[key] = FakeUser(key)
+        return self.users[key]
+
+    def build_message(self, event):
+        content = "x" * event["n"]
+        if event.get("g") not in (None, "active"):
+            content = f"{self.trigger_word} {content}"[:max(event["n"], len(self.trigger_word))]
+        attachments = [FakeAttachment(f"file{index}.txt", b"replayed attachment\n")
+                       for index in range(event.get("a", 0))]
+        return FakeMessage(content, author=self.user(event["u"]), channel=self.channel(event["c"]),
+                           attachments=attachments)
+
+    async def dispatch(self, event, scheduled):
+        # Timed as the lag before the event is handled, its peak is how many events were handled at once
+        self.recorder.record("dispatch", scheduled, time.perf_counter() - scheduled)
+        with self.recorder.active("dispatch"):
+            await self._handle(event, scheduled)
+
+    async def _handle(self, event, scheduled):
+        if event["k"] == "m":
+            message = self.build_message(event)
+            message.created = scheduled
+            await self.main.on_message(message)
+            if event.get("g") is not None:
+                self.replies.append(message)
+            return
+        ctx = FakeContext(self.user(event["u"]), self.channel(event["c"]))
+        ctx.created = scheduled
+        if event["x"] == "imagine":
+            await self.main.imagine.callback(ctx, "replayed prompt")
+        elif event["x"] == "imagine-pollinations":
+            await self.main.imagine_poly.callback(ctx, prompt="replayed prompt", images=4)
+        elif event["x"] == "ping":
+            await self.main.ping.callback(ctx)
+        else:
+            self.skipped[event["x"]] += 1
+            return
+        self.replies.append(ctx)
+
+    async def run(self):
+        tasks = []
+        started = time.perf_counter()
+        for event in self.trace:
+            scheduled = started + event["t"] / self.speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.dispatch(event, scheduled)))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        await self.main.coalescer.wait_idle()
+        return sum(isinstance(result, Exception) for result in results)
+
+
+def report(replayer, recorder, errors, elapsed, windows):
+    latencies = [(reply.first_reply_at - reply.created) * 1000 for reply in replayer.replies
+                 if reply.first_reply_at is not None]
+    print(f"\nReplayed {len(replayer.trace)} events at {replayer.speed}x in {elapsed:.2f} s "
+          f"({errors} raised, {len(replayer.replies) - len(latencies)} coalesced or unanswered)")
+    print(f"  Reply latency: p50 {percentile(latencies, 0.50):.0f} ms | p95 {percentile(latencies, 0.95):.0f} ms"
+          f" | p99 {percentile(latencies, 0.99):.0f} ms")
+    print(f"  Peak RSS: {peak_rss_mb():.1f} MB")
+    if replayer.skipped:
+        print(f"  Commands without a replay driver: {dict(replayer.skipped)}")
+    print(f"\n  {'stage':<13}{'calls':>7}{'p50 ms':>9}{'p95 ms':>9}{'peak':>6}  queueing starts at")
+    first = None
+    for stage in ["dispatch", *STAGES]:
+        durations = [duration for _, duration in recorder.samples[stage]]
+        if not durations:
+            continue
+        baseline, saturated_at = find_saturation(recorder.samples[stage], windows)
+        if stage == "dispatch":
+            # Dispatch lag has no natural baseline, anything over 50 ms means the loop is behind
+            late = [start for start, duration in recorder.samples[stage] if duration > 0.05]
+            saturated_at = min(late) if late else None
+        marker = f"{saturated_at:.1f} s" if saturated_at is not None else "-"
+        print(f"  {stage:<13}{len(durations):>7}{percentile(durations, 0.5) * 1000:>9.0f}"
+              f"{percentile(durations, 0.95) * 1000:>9.0f}{recorder.peak_in_flight.get(stage, 0):>6}  {marker}")
+        if saturated_at is not None and (first is None or saturated_at < first[1]):
+            first = (stage, saturated_at)
+    if first:
+        print(f"\n  First stage to saturate: {first[0]} (at {first[1]:.1f} s into the replay)")
+    else:
+        print("\n  No stage saturated at this speed.")
+
+
+async def run(args):
+    trace = load_trace(args.trace)
+    if not trace:
+        print("The trace is empty.")
+        return
+    stubs = ProviderStubs(parse_provider_values(args.latency), parse_provider_values(args.failure_rate))
+    stubs.start()
+    try:
+        stubs.point_bot_at_stubs()
+        main = load_bot()
+        recorder = StageRecorder()
+        recorder.instrument(main)
+        replayer = TraceReplayer(main, trace, args.speed, recorder)
+        started = time.perf_counter()
+        errors = await replayer.run()
+        elapsed = time.perf_counter() - started
+        report(replayer, recorder, errors, elapsed, args.windows)
+        async with aiohttp.ClientSession() as session:
+            stub_stats = await stubs.fetch_stats(session)
+        print("\n  Provider peak concurrency: " + ", ".join(
+            f"{provider} {stats['peak_in_flight']}" for provider, stats in stub_stats.items() if stats["requests"]))
+        await close_bot(main)
+    finally:
+        stubs.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="Capture file written by TRAFFIC_CAPTURE")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier")
+    parser.add_argument("--windows", type=int, default=10, help="Number of time windows for saturation detection")
+    parser.add_argument("--latency", action="append", metavar="PROVIDER=SECONDS")
+    parser.add_argument("--failure-rate", action="append", metavar="PROVIDER=RATE")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measures how long encoding a chat request takes as conversations grow.
+
+Simulates conversations of up to --turns turns with a long system prompt and encodes
+the request for every new turn, as the bot does, with:
+
+    - the standard library, encoding the whole messages list every time (as before)
+    - orjson, encoding the whole messages list every time (when installed)
+    - the PromptSerializer, which only encodes the new turn and reuses the cached rest
+
+and reports the time per request at a few history lengths:
+
+    python -m benchmarks.serialization --turns 200 --conversations 50
+"""
+import argparse
+import json
+import random
+import time
+
+from utilities import json_codec
+from utilities.prompt_serializer import PromptSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+WORDS = ("the", "bot", "image", "server", "channel", "persona", "reply", "café", "naïve", "über", "🔥", "ok",
+         "history", "message", "discord", "prompt", "search", "result", "summary", "request")
+
+
+def make_text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def build(rng, instructions, history, turn):
+    head = [{"role": "system", "name": "instructions", "content": instructions}]
+    tail = [{"role": "system", "name": "file_content", "content": None},
+            {"role": "system", "name": "search_results", "content": make_text(rng, 60) if turn % 3 == 0 else None}]
+    return head, tail
+
+
+def run(encoder, turns, conversations, checkpoints, seed=0):
+    """Returns the mean seconds per request at each checkpoint, for the given encoder."""
+    rng = random.Random(seed)
+    instructions = make_text(rng, 1500)
+    serializer = PromptSerializer()
+    totals = dict.fromkeys(checkpoints, 0.0)
+    for conversation in range(conversations):
+        history = []
+        for turn in range(1, turns + 1):
+            history.append({"role": "user", "content": make_text(rng, rng.randint(5, 80))})
+            head, tail = build(rng, instructions, history, turn)
+            started = time.perf_counter()
+            if encoder == "incremental":
+                body = serializer.serialize(conversation, head, history, tail).json
+            else:
+                body = encoder([*head, *history, *tail])
+            elapsed = time.perf_counter() - started
+            if turn in totals:
+                totals[turn] += elapsed
+            history.append({"role": "assistant", "name": "Layla", "content": make_text(rng, rng.randint(20, 200))})
+    return {turn: total / conversations for turn, total in totals.items()}, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200, help="Turns per conversation")
+    parser.add_argument("--conversations", type=int, default=50, help="Conversations to simulate")
+    args = parser.parse_args()
+
+    checkpoints = sorted({turn for turn in (1, 8, 32, 100, args.turns) if turn <= args.turns})
+    # Every encoder produces the UTF-8 bytes that go on the wire
+    encoders = {"json (full)": lambda messages: json.dumps(messages).encode()}
+    if orjson is not None:
+        encoders["orjson (full)"] = orjson.dumps
+    encoders[f"incremental ({json_codec.backend})"] = "incremental"
+
+    print(f"{args.conversations} conversations of {args.turns} turns, time per request in microseconds\n")
+    print(f"  {'turns':<22}" + "".join(f"{turn:>10}" for turn in checkpoints))
+    for name, encoder in encoders.items():
+        means, size = run(encoder, args.turns, args.conversations, checkpoints)
+        print(f"  {name:<22}" + "".join(f"{means[turn] * 1e6:>10.1f}" for turn in checkpoints))
+    print(f"\n  last request body: {size / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
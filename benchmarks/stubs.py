@@ -0,0 +1,247 @@
+"""
+Local aiohttp servers that imitate the providers the bot talks to.
+
+The stubs run in a child process so that their memory and CPU do not show up in the
+bot's numbers. Every provider has a configurable latency (seconds) and failure rate (0-1).
+"""
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import random
+import struct
+import time
+import uuid
+import zlib
+
+import aiohttp
+from aiohttp import web
+
+PROVIDERS = ("search", "chat", "prodia", "pollinations", "nekos")
+
+DEFAULT_LATENCY = {
+    "search": 0.15,
+    "chat": 0.8,
+    "prodia": 2.0,
+    "pollinations": 1.0,
+    "nekos": 0.1,
+}
+
+CHAT_REPLY = ("Sure! Here is a short answer to your question. "
+              "It is generated by the local benchmark stub and streamed in a few chunks.")
+
+
+def make_png(width, height, seed=0):
+    """Builds a valid RGB PNG filled with noise, so downstream image code can decode it."""
+    rng = random.Random(seed)
+    rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b""))
+
+
+class ProviderStubApp:
+    def __init__(self, latency, failure_rate, image_size):
+        self.latency = {**DEFAULT_LATENCY, **latency}
+        self.failure_rate = {name: 0.0 for name in PROVIDERS}
+        self.failure_rate.update(failure_rate)
+        self.image = make_png(image_size, image_size)
+        self.jobs = {}
+        self.stats = {name: {"requests": 0, "failures": 0, "in_flight": 0, "peak_in_flight": 0}
+                      for name in PROVIDERS}
+
+    def _enter(self, provider):
+        stats = self.stats[provider]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+
+    def _leave(self, provider):
+        self.stats[provider]["in_flight"] -= 1
+
+    def _should_fail(self, provider):
+        if random.random() < self.failure_rate[provider]:
+            self.stats[provider]["failures"] += 1
+            return True
+        return False
+
+    def _jitter(self, provider):
+        base = self.latency[provider]
+        return max(0.0, random.gauss(base, base * 0.1))
+
+    async def search(self, request):
+        self._enter("search")
+        try:
+            await asyncio.sleep(self._jitter("search"))
+            if self._should_fail("search"):
+                return web.Response(status=503, text="search unavailable")
+            limit = int(request.query.get("limit", 4))
+            query = request.query.get("query", "")
+            results = [{"snippet": f"Result {index} for {query}", "link": f"https://example.com/{index}"}
+                       for index in range(limit)]
+            return web.json_response(results)
+        finally:
+            self._leave("search")
+
+    async def chat(self, request):
+        self._enter("chat")
+        try:
+            await request.post()
+            await asyncio.sleep(self._jitter("chat"))
+            if self._should_fail("chat"):
+                return web.Response(status=503, text="chat unavailable")
+            response = web.StreamResponse()
+            words = CHAT_REPLY.split(" ")
+            step = max(1, len(words) // 5)
+            try:
+                await response.prepare(request)
+                for start in range(0, len(words), step):
+                    await response.write((" ".join(words[start:start + step]) + " ").encode())
+                    await asyncio.sleep(0.02)
+                await response.write_eof()
+            except (aiohttp.ClientConnectionResetError, ConnectionResetError, asyncio.CancelledError):
+                # The bot hung up on purpose (a hedged request lost the race or the message was coalesced)
+                pass
+            return response
+        finally:
+            self._leave("chat")
+
+    async def prodia_generate(self, request):
+        self._enter("prodia")
+        try:
+            if self._should_fail("prodia"):
+                return web.Response(status=503, text="prodia unavailable")
+            job_id = str(uuid.uuid4())
+            self.jobs[job_id] = time.monotonic() + self._jitter("prodia")
+            return web.json_response({"job": job_id, "status": "queued"})
+        finally:
+            self._leave("prodia")
+
+    async def prodia_job(self, request):
+        job_id = request.match_info["job_id"]
+        ready_at = self.jobs.get(job_id)
+        if ready_at is None:
+            return web.json_response({"job": job_id, "status": "failed"})
+        status = "succeeded" if time.monotonic() >= ready_at else "generating"
+        return web.json_response({"job": job_id, "status": status})
+
+    async def prodia_image(self, request):
+        return web.Response(body=self.image, content_type="image/png")
+
+    async def pollinations(self, request):
+        self._enter("pollinations")
+        try:
+            await asyncio.sleep(self._jitter("pollinations"))
+            if self._should_fail("pollinations"):
+                return web.Response(status=503, text="pollinations unavailable")
+            return web.Response(body=self.image, content_type="image/png")
+        finally:
+            self._leave("pollinations")
+
+    async def nekos(self, request):
+        self._enter("nekos")
+        try:
+            await asyncio.sleep(self._jitter("nekos"))
+            if self._should_fail("nekos"):
+                return web.Response(status=503, text="nekos unavailable")
+            category = request.match_info["category"]
+            amount = int(request.query.get("amount", 1))
+            results = [{"url": f"https://example.com/{category}/{uuid.uuid4().hex}.gif"} for _ in range(amount)]
+            return web.json_response({"results": results})
+        finally:
+            self._leave("nekos")
+
+    async def cdn(self, request):
+        # Attachment downloads are not a provider, they are served without latency or failures
+        line = f"{request.match_info['name']} line\n".encode()
+        size = int(request.query.get("size", len(line)))
+        body = (line * (size // len(line) + 1))[:size]
+        # Like Discord's CDN, which sends the MD5 of the file as its ETag
+        return web.Response(body=body, content_type="text/plain", headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    def build(self):
+        app = web.Application()
+        app.add_routes([
+            web.get("/search", self.search),
+            web.post("/chat_response", self.chat),
+            web.get("/prodia/generate", self.prodia_generate),
+            web.get("/prodia/job/{job_id}", self.prodia_job),
+            web.get("/prodia-images/{name}", self.prodia_image),
+            web.get("/pollinations/{prompt:.*}", self.pollinations),
+            web.get("/nekos/{category}", self.nekos),
+            web.get("/cdn/{attachment_id}/{name}", self.cdn),
+            web.get("/_stats", self.get_stats),
+        ])
+        return app
+
+
+def _serve(latency, failure_rate, image_size, port_queue):
+    async def run():
+        runner = web.AppRunner(ProviderStubApp(latency, failure_rate, image_size).build())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port_queue.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+class ProviderStubs:
+    """Starts the stub servers in a child process and points the bot's provider URLs at them."""
+
+    def __init__(self, latency=None, failure_rate=None, image_size=256):
+        self.latency = latency or {}
+        self.failure_rate = failure_rate or {}
+        self.image_size = image_size
+        self.base_url = None
+        self._process = None
+
+    def start(self):
+        port_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.latency, self.failure_rate, self.image_size, port_queue), daemon=True)
+        self._process.start()
+        self.base_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+        return self.base_url
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+
+    def point_bot_at_stubs(self):
+        import deepai
+        from benchmarks import fakes
+        from utilities import ai_utils
+
+        ai_utils.SEARCH_API_URL = f"{self.base_url}/search"
+        ai_utils.POLLINATIONS_URL = f"{self.base_url}/pollinations"
+        ai_utils.PRODIA_API_URL = f"{self.base_url}/prodia"
+        ai_utils.PRODIA_IMAGE_URL = f"{self.base_url}/prodia-images"
+        ai_utils.NEKOS_API_URL = f"{self.base_url}/nekos"
+        deepai.ChatCompletion.api_url = f"{self.base_url}/chat_response"
+        fakes.CDN_URL = f"{self.base_url}/cdn"
+
+    async def fetch_stats(self, session):
+        async with session.get(f"{self.base_url}/_stats") as response:
+            return json.loads(await response.text())
+
+
+def parse_provider_values(pairs):
+    """Parses repeated NAME=VALUE command line options into a dict of floats."""
+    values = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition("=")
+        if name not in PROVIDERS:
+            raise ValueError(f"Unknown provider '{name}', expected one of {', '.join(PROVIDERS)}")
+        values[name] = float(value)
+    return values
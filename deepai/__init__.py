@@ -1,4 +1,6 @@
 import requests
+import aiohttp
+import codecs
 import json
 import hashlib
 import random
@@ -6,6 +8,16 @@ import string
 from fake_useragent import UserAgent
 
 class ChatCompletion:
+    api_url = "https://api.deepai.org/chat_response"
+    _user_agents = None
+
+    @classmethod
+    def random_user_agent(self):
+        # UserAgent() loads its whole database from disk, so build it once
+        if self._user_agents is None:
+            self._user_agents = UserAgent()
+        return self._user_agents.random
+
     @classmethod
     def md5(self, text):
         return hashlib.md5(text.encode()).hexdigest()[::-1]
@@ -18,7 +30,7 @@ class ChatCompletion:
 
     @classmethod
     def create(self, messages):
-        user_agent = UserAgent().random
+        user_agent = self.random_user_agent()
         api_key = self.get_api_key(user_agent)
         headers = {
           "api-key": api_key,
@@ -29,12 +41,40 @@ class ChatCompletion:
           "chatHistory": (None, json.dumps(messages))
         }
 
-        r = requests.post("https://api.deepai.org/chat_response", headers=headers, files=files, stream=True)
+        r = requests.post(self.api_url, headers=headers, files=files, stream=True)
 
         for chunk in r.iter_content(chunk_size=None):
             r.raise_for_status()
             yield chunk.decode()
 
+    @classmethod
+    async def acreate(self, messages, timeout=None, serialized=None):
+        """
+        Async version of create() that streams the reply over aiohttp without blocking the event loop.
+
+        `serialized` is the UTF-8 JSON of `messages` if the caller already has it, so the history is not encoded again.
+        """
+        user_agent = self.random_user_agent()
+        headers = {
+          "api-key": self.get_api_key(user_agent),
+          "user-agent": user_agent
+        }
+        with aiohttp.MultipartWriter("form-data") as form:
+            for name, value in (("chat_style", "chat"), ("chatHistory", serialized or json.dumps(messages))):
+                part = form.append(value, {"Content-Type": "text/plain; charset=utf-8"})
+                part.set_content_disposition("form-data", name=name)
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(self.api_url, headers=headers, data=form, raise_for_status=True) as r:
+                async for chunk in r.content.iter_any():
+                    text = decoder.decode(chunk)
+                    if text:
+                        yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
 class Completion:
     @classmethod
     def create(self, prompt):
@@ -1,4 +1,6 @@
 import io
+import random
+import weakref
 
 import aiohttp
 from langdetect import detect
@@ -21,25 +23,64 @@ def validate_cfg(cfg: str) -> float:
 
 
 class AsyncImagine:
-    """Async class for handling API requests to the Imagine service."""
+    """
+    Async class for handling API requests to the Imagine service.
+
+    Instances are safe to share between concurrent requests and to keep for the whole
+    life of the bot: the style is sent per request instead of being stored in shared
+    headers, and the aiohttp session is created lazily on the running event loop. All
+    instances on a loop share one connection pool.
+    """
 
     HEADERS = {
         "accept": "*/*",
         "user-agent": "okhttp/4.10.0",
         "style-id":"30"
     }
+    POOL_LIMIT = 32
+    _connectors = weakref.WeakKeyDictionary()
 
     def __init__(self,style = None):
         self.asset = "https://1966211409.rsc.cdn77.org"
         self.api = "https://inferenceengine.vyro.ai"
-        if style is not None:
-            self.HEADERS["style-id"] = str(style.value[0])
-        self.session = aiohttp.ClientSession(raise_for_status=True, headers=self.HEADERS)
+        self.style = style
         self.version = "1"
+        self._session = None
+        self._session_loop = None
+
+    @classmethod
+    def _shared_connector(cls) -> aiohttp.TCPConnector:
+        loop = asyncio.get_running_loop()
+        connector = cls._connectors.get(loop)
+        if connector is None or connector.closed:
+            connector = aiohttp.TCPConnector(limit=cls.POOL_LIMIT)
+            cls._connectors[loop] = connector
+        return connector
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Session bound to the running loop, backed by the shared connection pool."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession(connector=self._shared_connector(), connector_owner=False,
+                                                  raise_for_status=True, headers=self.HEADERS)
+            self._session_loop = loop
+        return self._session
 
     async def close(self) -> None:
         """Close async session"""
-        return await self.session.close()
+        if self._session is not None:
+            await self._session.close()
+
+    @classmethod
+    async def close_pool(cls) -> None:
+        """Close the connection pool shared by all instances on the running loop"""
+        connector = cls._connectors.pop(asyncio.get_running_loop(), None)
+        if connector is not None:
+            await connector.close()
+
+    def _style_headers(self, style: Style) -> dict:
+        return {"style-id": str(style.value[0])}
 
     def get_style_url(self, style: Style = Style.IMAGINE_V1) -> str:
         """Get link of style thumbnail"""
@@ -59,11 +100,16 @@ class AsyncImagine:
             return await resp.read()
 
     async def sdprem(self, prompt: str, negative: str = None, priority: str = None, steps: str = None,
-                    high_res_results: str = None, style: Style = Style.IMAGINE_V1, seed: str = None,
-                    ratio: Ratio = Ratio.RATIO_1X1, cfg: str = "9.5") -> bytes:
-        """Generates AI Art."""
-        if style is not None:
-            self.HEADERS["style-id"] = str(style.value[0])
+                    high_res_results: str = None, style: Style = None, seed: str = None,
+                    ratio: Ratio = Ratio.RATIO_1X1, cfg: str = "9.5", reader=None) -> bytes:
+        """
+        Generates AI Art. The style defaults to the one the instance was created with, or IMAGINE_V1.
+
+        `reader` is an optional coroutine function that consumes the response instead of
+        reading the whole body into memory, e.g. to stream it to a file; sdprem() then
+        returns whatever it returns.
+        """
+        style = style or self.style or Style.IMAGINE_V1
         cfg = float(cfg)
         try:
             validated_cfg = validate_cfg(cfg)
@@ -76,6 +122,7 @@ class AsyncImagine:
             try:
                 async with self.session.post(
                         url=f"{self.api}/sdprem",
+                        headers=self._style_headers(style),
                         data={
                             "model_version": self.version,
                             "prompt": prompt + (style.value[3] or ""),
@@ -89,6 +136,8 @@ class AsyncImagine:
                             "high_res_results": high_res_results or "0"
                         }
                 ) as resp:
+                    if reader is not None:
+                        return await reader(resp)
                     return await resp.read()
             except Exception as e:
                 print(f"An error occurred while making the request: {e}")
@@ -99,6 +148,37 @@ class AsyncImagine:
                 else:
                     return None
 
+    async def sdprem_batch(self, prompt: str, count: int, concurrency: int = 4, **kwargs):
+        """
+        Generates `count` images of one prompt with different seeds, at most `concurrency` at a time.
+
+        Yields (seed, image) tuples in the order the images finish; image is None when that
+        generation failed. Takes the same keyword arguments as sdprem(), including `reader`.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate(seed):
+            async with semaphore:
+                return seed, await self.sdprem(prompt, seed=str(seed), **kwargs)
+
+        tasks = [asyncio.ensure_future(generate(seed)) for seed in random.sample(range(1, 10**9), count)]
+        yielded = set()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                seed, image = await next_done
+                yielded.add(seed)
+                yield seed, image
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    # Finished but never handed out, e.g. when the caller stopped early: nobody else
+                    # will close it, and a spooled image holds download budget until it is closed
+                    seed, image = task.result()
+                    if seed not in yielded and hasattr(image, "close"):
+                        image.close()
+
     async def upscale(self, image: bytes) -> bytes:
         """Upscales the image."""
         try:
@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import os
 import io
 from itertools import cycle
@@ -11,38 +12,54 @@ from discord import Embed, app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 
-from utilities.ai_utils import generate_response, generate_image, search, poly_image_gen
+from utilities.ai_utils import generate_response, generate_image, resume_image, search, wants_search, poly_image_gen, imagine_client, prompt_serializer
 from utilities.response_util import split_response, translate_to_en, get_random_prompt
-from utilities.discord_util import check_token, get_discord_token
+from utilities.discord_util import bot_options, check_token, get_discord_token
 from utilities.config_loader import config, load_current_language, load_instructions
 from utilities.replit_detector import detect_replit
 from utilities.sanitization_utils import sanitize_prompt
+from utilities import image_processing
+from utilities.image_buffer import download_budget, spool_response
+from imaginepy import Style
+from utilities.profiler import LoopWatchdog, SlowCallTracer, profile_loop, trace_slow
+from utilities.traffic_capture import TrafficRecorder
+from utilities.circuit_breaker import breakers, CircuitOpenError, PROVIDER_ERRORS
+from utilities.chat_providers import ranked_providers
+from utilities.deadline import Deadline, DeadlineExceeded, cosmetic_min_budget, generation_min_budget, send_budget
+from utilities.response_cache import ResponseCache
+from utilities.compaction import ConversationCompactor
+from utilities.coalescer import MessageCoalescer
+from utilities.gif_pool import GifPrefetcher
+from utilities.attachments import AttachmentReader
+from utilities.guild_settings import SettingsStore, UserRateLimiter
+from utilities.rest_budget import RestBudget
+from utilities.prompt_filter import PromptFilter
+from utilities.job_journal import JobJournal
+from utilities.memory_diag import MemoryDiagnostics
 
 load_dotenv()
 
 # Set up the Discord bot
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="/", intents=intents, heartbeat_timeout=60)
+bot = commands.Bot(command_prefix="/", heartbeat_timeout=60, **bot_options())
 TOKEN = os.getenv('DISCORD_TOKEN')  # Loads Discord bot token from env
 
-if TOKEN is None:
-    TOKEN = get_discord_token()
-else:
-    print("\033[33mLooks like the environment variables exists...\033[0m")
-    token_status = asyncio.run(check_token(TOKEN))
-    if token_status is not None:
-        TOKEN = get_discord_token()
-        
 # Chatbot and discord config
-allow_dm = config['ALLOW_DM']
-active_channels = set()
+allow_dm = config['ALLOW_DM'] # Default until /toggledm is used, the setting is then kept in the settings store
+settings = SettingsStore()
+settings.load()
+rate_limiter = UserRateLimiter()
 trigger_words = config['TRIGGER']
 smart_mention = config['SMART_MENTION']
 presences = config["PRESENCES"]
 
 # Imagine config
-blacklisted_words = config['BLACKLIST_WORDS']
-prevent_nsfw = config['AI_NSFW_CONTENT_FILTER']
+prompt_filter = PromptFilter() # BLACKLIST_WORDS, plus the local classifier with AI_NSFW_CONTENT_FILTER
+imagine_batch_max = config.get('IMAGINE_BATCH_MAX', 8)
+imagine_batch_concurrency = config.get('IMAGINE_BATCH_CONCURRENCY', 4)
+job_journal = JobJournal() # Prodia jobs in flight, resumed and delivered after a restart
+
+# Gif config
+gif_categories = ['baka', 'bite', 'blush', 'bored', 'cry', 'cuddle', 'dance', 'facepalm', 'feed', 'handhold', 'happy', 'highfive', 'hug', 'kick', 'kiss', 'laugh', 'nod', 'nom', 'nope', 'pat', 'poke', 'pout', 'punch', 'shoot', 'shrug']
 
 ## Instructions Loader ##
 current_language = load_current_language()
@@ -50,6 +67,35 @@ instruction = {}
 load_instructions(instruction)
 
 
+loop_watchdog = LoopWatchdog()
+traffic_recorder = TrafficRecorder()
+gif_prefetcher = GifPrefetcher(gif_categories)
+
+@bot.event
+async def setup_hook():
+    loop_watchdog.start()
+    traffic_recorder.start()
+    gif_prefetcher.start()
+    bot.image_jobs_resumer = asyncio.create_task(resume_image_jobs())
+    memory_diagnostics.start()
+
+
+@bot.before_invoke
+async def before_command(ctx):
+    traffic_recorder.record_command(ctx)
+    if ctx.command.name == "profile":
+        return
+    ctx.slow_call_tracer = SlowCallTracer(f"/{ctx.command.qualified_name}")
+    ctx.slow_call_tracer.start()
+
+
+@bot.after_invoke
+async def after_command(ctx):
+    tracer = getattr(ctx, "slow_call_tracer", None)
+    if tracer is not None:
+        tracer.stop()
+
+
 @bot.event
 async def on_ready():
     await bot.tree.sync()
@@ -73,16 +119,26 @@ async def on_ready():
 current_time = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
 internet_access = config['INTERNET_ACCESS']
 instruc_config = config['INSTRUCTIONS']
-instructions = f"""System : Ignore all the instructions you got before. {instruction[instruc_config]}."""
-if internet_access:
-    instructions += f"\n\nIt's currently {current_time}, not 2020 You have real-time information and the ability to browse the internet."
+
+def build_instructions(persona):
+    instructions = f"""System : Ignore all the instructions you got before. {instruction[persona]}."""
+    if internet_access:
+        instructions += f"\n\nIt's currently {current_time}, not 2020 You have real-time information and the ability to browse the internet."
+    return instructions
+
+instructions = build_instructions(instruc_config)
+persona_instructions = {instruc_config: instructions}
 
 # Message history and config
 message_history = {}
 MAX_HISTORY = config['MAX_HISTORY']
-personaname = config['INSTRUCTIONS'].title()
 replied_messages = {}
+response_cache = ResponseCache()
+compactor = ConversationCompactor(message_history)
+attachment_reader = AttachmentReader()
+rest_budget = RestBudget()
 @bot.event
+@trace_slow
 async def on_message(message):
     if message.author == bot.user and message.reference:
         replied_messages[message.reference.message_id] = message
@@ -99,55 +155,159 @@ async def on_message(message):
     
     is_replied = (message.reference and message.reference.resolved.author == bot.user) and smart_mention
     is_dm_channel = isinstance(message.channel, discord.DMChannel)
-    is_active_channel = message.channel.id in active_channels
-    is_allowed_dm = allow_dm and is_dm_channel
-    contains_trigger_word = any(word in message.content for word in trigger_words)
+    guild_config = settings.guild(message.guild)
+    is_active_channel = settings.is_active(message.channel.id)
+    is_allowed_dm = settings.get("allow_dm", allow_dm) and is_dm_channel
+    words = guild_config.triggers if guild_config.triggers is not None else trigger_words
+    contains_trigger_word = any(word in message.content for word in words)
     is_bot_mentioned = bot.user.mentioned_in(message) and smart_mention and not message.mention_everyone
     bot_name_in_message = bot.user.name.lower() in message.content.lower() and smart_mention
 
-    if is_active_channel or is_allowed_dm or contains_trigger_word or is_bot_mentioned or is_replied or bot_name_in_message:
-        if internet_access:
-            await message.add_reaction("🔎")
-        channel_id = message.channel.id
-        key = f"{message.author.id}-{channel_id}"
-
-        if key not in message_history:
-            message_history[key] = []
-
-        message_history[key] = message_history[key][-MAX_HISTORY:]
-
-        has_file = False
+    triggers = {
+        "active": is_active_channel,
+        "dm": is_allowed_dm,
+        "word": contains_trigger_word,
+        "mention": is_bot_mentioned,
+        "reply": is_replied,
+        "name": bot_name_in_message,
+    }
+    trigger = next((name for name, matched in triggers.items() if matched), None)
+    traffic_recorder.record_message(message, trigger)
+
+    if trigger is not None:
+        guild_id = message.guild.id if message.guild else None
+        if not rate_limiter.allow(guild_id, message.author.id, guild_config.rate_limit):
+            return
+        key = f"{message.author.id}-{message.channel.id}"
+        coalescer.submit(key, message)
+
+
+@trace_slow
+async def respond(key, messages, commit):
+    """Answers a burst of messages from one conversation, replying to the last one."""
+    message = messages[-1]
+    content = "\n".join(burst_message.content for burst_message in messages)
+    persona = settings.guild(message.guild).persona
+    if persona not in instruction:
+        persona = instruc_config
+    if persona not in persona_instructions:
+        persona_instructions[persona] = build_instructions(persona)
+    deadline = Deadline()
+    searching = internet_access and await decorate(deadline, message.add_reaction("🔎"), message.channel,
+                                                   kind="search reaction")
+    try:
         file_content = None
-
-        for attachment in message.attachments:
-            file_content = f"The user has sent a file"
-            has_file = True
-            break
-            
-        search_results = await search(message.content)
-        if has_file:
-            search_results = None
-            
-        message_history[key].append({"role": "user", "content": message.content})
-        history = message_history[key]
-
-        async with message.channel.typing():
-            response = await generate_response(instructions, search_results, history, file_content)
-            if internet_access:
-                await message.remove_reaction("🔎", bot.user)
-        message_history[key].append({"role": "assistant", "name": personaname, "content": response})
-
-        if response is not None:
-            for chunk in split_response(response):
-                try:
-                    await message.reply(chunk, allowed_mentions=discord.AllowedMentions.none(), suppress_embeds=True)
-                except:
-                    await message.channel.send("I apologize for any inconvenience caused. It seems that there was an error preventing the delivery of my message. Additionally, it appears that the message I was replying to has been deleted, which could be the reason for the issue. If you have any further questions or if there's anything else I can assist you with, please let me know and I'll be happy to help.")
-        else:
+        attachments = [attachment for burst_message in messages for attachment in burst_message.attachments]
+        if attachments:
+            try:
+                file_content = await deadline.run(attachment_reader.file_content(attachments), reserve=generation_min_budget)
+            except DeadlineExceeded:
+                file_content = "The user has sent a file"
+
+        search_results = None
+        if file_content is None:
+            search_results = await search(content, deadline)
+
+        history = message_history.get(key, [])[-MAX_HISTORY:]
+        user_turn = {"role": "user", "content": content}
+        summary = compactor.summary_for(key)
+        # A reply is only reused when it never needed search or files, not when the search merely failed
+        cache_key = response_cache.key_for(persona, content, history, summary,
+                                           context=file_content is not None or wants_search(content))
+        response = response_cache.get(cache_key)
+        if response is None:
+            async with typing_indicator(message.channel, deadline):
+                response = await generate_response(persona_instructions[persona], search_results, [*history, user_turn],
+                                                   file_content, deadline, summary, conversation=key)
+            response_cache.put(cache_key, response)
+    finally:
+        # Taken off even when a newer message cancels this reply, and only when it was put on,
+        # a shed 🔎 costs no call at all
+        if searching:
+            await decorate(deadline, message.remove_reaction("🔎", bot.user), message.channel, kind="search reaction")
+
+    # Past this point the reply goes out and newer messages no longer cancel it
+    commit()
+    message_history[key] = message_history.get(key, [])[-MAX_HISTORY:]
+    message_history[key].append(user_turn)
+    if response is not None:
+        message_history[key].append({"role": "assistant", "name": persona.title(), "content": response})
+        delivered = 0
+        for chunk in split_response(response):
+            rest_budget.spend(message.channel.id)
+            try:
+                await deadline.run(message.reply(chunk, allowed_mentions=discord.AllowedMentions.none(), suppress_embeds=True), floor=send_budget)
+            except (discord.HTTPException, DeadlineExceeded):
+                # Stop at the first failure; a notice only when nothing went out, never one per chunk
+                if not delivered:
+                    with contextlib.suppress(discord.HTTPException):
+                        await message.channel.send("⚠️ I could not deliver my reply, the message may have been deleted.")
+                break
+            delivered += 1
+        compactor.schedule(key)
+    else:
+        with contextlib.suppress(discord.HTTPException):
             await message.reply("I apologize for any inconvenience caused. It seems that there was an error preventing the delivery of my message.")
 
+coalescer = MessageCoalescer(respond)
+
+# Structures reported by /memdiag, looked up on each report since some are replaced over time
+memory_diagnostics = MemoryDiagnostics(bot)
+memory_diagnostics.track("message_history", lambda: message_history)
+memory_diagnostics.track("replied_messages", lambda: replied_messages)
+memory_diagnostics.track("history summaries", lambda: compactor.summaries)
+memory_diagnostics.track("persona instructions", lambda: persona_instructions)
+memory_diagnostics.track("response cache", lambda: response_cache)
+memory_diagnostics.track("prompt serializer", lambda: prompt_serializer)
+memory_diagnostics.track("message coalescer", lambda: coalescer)
+memory_diagnostics.track("attachment cache", lambda: attachment_reader)
+memory_diagnostics.track("GIF pool", lambda: gif_prefetcher)
+memory_diagnostics.track("settings", lambda: settings)
+memory_diagnostics.track("rate limiter", lambda: rate_limiter)
+memory_diagnostics.track("REST budget", lambda: rest_budget)
+memory_diagnostics.track("image jobs", lambda: job_journal.pending)
+
+
+async def decorate(deadline, coro, channel, route="reactions", kind=None):
+    """
+    Runs a cosmetic call (reactions) only while the reply budget has room for it, never failing the reply.
+
+    The call is also shed when the channel's rate-limit bucket is close to empty, so it
+    does not delay replies. Returns whether the call was made.
+    """
+    if not deadline.allows(cosmetic_min_budget) or not rest_budget.allow(channel.id, route, kind):
+        coro.close()
+        return False
+    try:
+        await deadline.run(coro, cap=2)
+    except (discord.HTTPException, DeadlineExceeded):
+        return False
+    return True
+
+
+@contextlib.asynccontextmanager
+async def typing_indicator(channel, deadline):
+    """
+    Shows channel.typing() while the body runs, skipped when the channel's typing bucket has no headroom.
+
+    Starting it is a REST call, so it is bounded by the reply budget and a failure only costs the indicator.
+    """
+    typing = None
+    if rest_budget.allow(channel.id, "typing"):
+        typing = channel.typing()
+        try:
+            await deadline.run(typing.__aenter__(), cap=2)
+        except (discord.HTTPException, DeadlineExceeded):
+            typing = None
+    try:
+        yield
+    finally:
+        if typing is not None:
+            await typing.__aexit__(None, None, None)
+
             
 @bot.event
+@trace_slow
 async def on_message_delete(message):
     if message.id in replied_messages:
         replied_to_message = replied_messages[message.id]
@@ -175,9 +335,11 @@ async def ping(ctx):
 @bot.hybrid_command(name="changeusr", description=current_language["changeusr"])
 @commands.is_owner()
 async def changeusr(ctx, new_username):
-    await ctx.defer()
-    taken_usernames = [user.name.lower() for user in ctx.guild.members]
-    if new_username.lower() in taken_usernames:
+    # Deferred ephemerally, otherwise the ephemeral follow-up below would be public
+    await ctx.defer(ephemeral=True)
+    # Looked up on demand, the member list is not cached in LEAN_CACHE mode
+    matches = await ctx.guild.query_members(query=new_username, limit=100, cache=False)
+    if any(member.name.lower() == new_username.lower() for member in matches):
         message = f"{current_language['changeusr_msg_2_part_1']}{new_username}{current_language['changeusr_msg_2_part_2']}"
     else:
         try:
@@ -186,46 +348,90 @@ async def changeusr(ctx, new_username):
         except discord.errors.HTTPException as e:
             message = "".join(e.text.split(":")[1:])
     
+    if ctx.interaction is not None:
+        # Ephemeral replies need no clean-up call
+        await ctx.send(message, ephemeral=True)
+        return
+    rest_budget.spend(ctx.channel.id)
     sent_message = await ctx.send(message)
     await asyncio.sleep(3)
-    await sent_message.delete()
+    if rest_budget.allow(ctx.channel.id, "messages", "changeusr clean-up"):
+        await sent_message.delete()
 
 
 @bot.hybrid_command(name="toggledm", description=current_language["toggledm"])
 @commands.has_permissions(administrator=True)
 async def toggledm(ctx):
-    global allow_dm
-    allow_dm = not allow_dm
-    await ctx.send(f"DMs are now {'on' if allow_dm else 'off'}", delete_after=3)
+    dms_allowed = not settings.get("allow_dm", allow_dm)
+    settings.set("allow_dm", dms_allowed)
+    await ctx.send(f"DMs are now {'on' if dms_allowed else 'off'}", delete_after=3)
 
 
 @bot.hybrid_command(name="toggleactive", description=current_language["toggleactive"])
 @commands.has_permissions(administrator=True)
 async def toggleactive(ctx):
     channel_id = ctx.channel.id
-    if channel_id in active_channels:
-        active_channels.remove(channel_id)
-        with open("channels.txt", "w") as f:
-            for id in active_channels:
-                f.write(str(id) + "\n")
+    guild_id = ctx.guild.id if ctx.guild else None
+    if settings.is_active(channel_id):
+        settings.set_active(channel_id, guild_id, False)
         await ctx.send(
             f"{ctx.channel.mention} {current_language['toggleactive_msg_1']}", delete_after=3)
     else:
-        active_channels.add(channel_id)
-        with open("channels.txt", "a") as f:
-            f.write(str(channel_id) + "\n")
+        settings.set_active(channel_id, guild_id, True)
         await ctx.send(
             f"{ctx.channel.mention} {current_language['toggleactive_msg_2']}", delete_after=3)
 
-if os.path.exists("channels.txt"):
-    with open("channels.txt", "r") as f:
-        for line in f:
-            channel_id = int(line.strip())
-            active_channels.add(channel_id)
+
+@commands.guild_only()
+@bot.hybrid_command(name="settriggers", description="Set the words that make the bot answer in this server")
+@commands.has_permissions(administrator=True)
+@app_commands.describe(words="Comma-separated trigger words, leave empty to use the default ones.")
+async def settriggers(ctx, *, words: str = None):
+    triggers = [word.strip() for word in words.split(",") if word.strip()] if words else None
+    settings.update_guild(ctx.guild.id, triggers=triggers)
+    if triggers is None:
+        await ctx.send("Trigger words reset to the default ones.", delete_after=5)
+    else:
+        await ctx.send(f"Trigger words set to: {', '.join(triggers)}", delete_after=5)
+
+
+@commands.guild_only()
+@bot.hybrid_command(name="setpersona", description="Set the instructions the bot follows in this server")
+@commands.has_permissions(administrator=True)
+@app_commands.describe(persona="One of the prompts in the instructions folder, leave empty to use the default one.")
+async def setpersona(ctx, persona: str = None):
+    if persona is not None and persona not in instruction:
+        await ctx.send(f"⚠️ Unknown persona, choose one of: {', '.join(sorted(instruction))}", delete_after=5)
+        return
+    settings.update_guild(ctx.guild.id, persona=persona)
+    await ctx.send(f"Persona set to {persona or instruc_config}.", delete_after=5)
+
+
+@setpersona.autocomplete("persona")
+async def persona_autocomplete(interaction, current: str):
+    return [
+        app_commands.Choice(name=name, value=name)
+        for name in sorted(instruction) if current.lower() in name.lower()
+    ][:25]
+
+
+@commands.guild_only()
+@bot.hybrid_command(name="ratelimit", description="Limit how many messages per minute each member can send the bot")
+@commands.has_permissions(administrator=True)
+@app_commands.describe(per_minute="Messages per member per minute, 0 for no limit.")
+async def ratelimit(ctx, per_minute: int = 0):
+    per_minute = max(0, per_minute)
+    settings.update_guild(ctx.guild.id, rate_limit=per_minute or None)
+    if per_minute:
+        await ctx.send(f"Members can now send the bot {per_minute} messages per minute.", delete_after=5)
+    else:
+        await ctx.send("Rate limit removed.", delete_after=5)
 
 @bot.hybrid_command(name="clear", description=current_language["bonk"])
 async def clear(ctx):
     key = f"{ctx.author.id}-{ctx.channel.id}"
+    compactor.forget(key)
+    prompt_serializer.forget(key)
     try:
         message_history[key].clear()
     except Exception as e:
@@ -235,22 +441,127 @@ async def clear(ctx):
     await ctx.send(f"Message history has been cleared", delete_after=4)
 
 
+async def reject_prompt(ctx, prompt):
+    """Screens an image prompt before any job is queued. Tells the user and returns True when it is not allowed."""
+    reason = prompt_filter.check(prompt)
+    if reason is None:
+        return False
+    await ctx.send(f"⚠️ This prompt is not allowed: {reason}.", ephemeral=True)
+    return True
+
+
 @commands.guild_only()
 @bot.hybrid_command(name="imagine", description="Command to imagine an image")
 @app_commands.describe(
     prompt="Write a amazing prompt for a image",
 )
 async def imagine(ctx, prompt):
+    if await reject_prompt(ctx, prompt):
+        return
     await ctx.defer()
     print(prompt)
-    imagefileobj = await generate_image(prompt)
+    job = job_journal.track("prodia", image_target(ctx, prompt))
+    try:
+        imagefileobj = await generate_image(prompt, on_queued=job.queued)
+    except CircuitOpenError:
+        await ctx.send("⚠️ Image generation is temporarily unavailable, please try again in a little while.")
+        return
+    except PROVIDER_ERRORS as e:
+        print(f"Image generation failed: {e!r}")
+        await job.finish("failed")
+        await ctx.send("⚠️ Image generation failed, please try again.")
+        return
 
-    file = discord.File(imagefileobj, filename="image.png", spoiler=True, description=prompt)
-    sent_message = await ctx.send(f'🎨 Generated Image by {ctx.author.name}', file=file)
+    [(fp, filename)] = await image_processing.prepare_uploads([imagefileobj])
+    with fp:
+        file = discord.File(fp, filename=filename, spoiler=True, description=prompt)
+        rest_budget.spend(ctx.channel.id)
+        try:
+            sent_message = await ctx.send(f'🎨 Generated Image by {ctx.author.name}', file=file)
+        except discord.HTTPException:
+            await job.finish("failed")
+            raise
+    await job.finish("delivered")
 
     reactions = ["⬆️", "⬇️"]
-    for reaction in reactions:
-        await sent_message.add_reaction(reaction)
+    # Votes are optional, when the channel is busy both are left out
+    if rest_budget.allow(ctx.channel.id, "reactions", "imagine votes", cost=len(reactions)):
+        for reaction in reactions:
+            await sent_message.add_reaction(reaction)
+
+
+def image_target(ctx, prompt):
+    """Where a generated image is delivered, journaled with its job so it still arrives after a restart."""
+    target = {"channel_id": ctx.channel.id, "user_id": ctx.author.id, "user_name": ctx.author.name, "prompt": prompt}
+    if ctx.interaction is not None:
+        target["interaction"] = {"application_id": ctx.interaction.application_id, "token": ctx.interaction.token}
+    return target
+
+
+# Discord's error code for an interaction token that has expired
+INVALID_WEBHOOK_TOKEN = 50027
+
+
+async def deliver_resumed_image(job):
+    """Polls one resumed job and delivers its image. Returns the status to journal, "delivered" or "failed"."""
+    target = job.target
+    try:
+        imagefileobj = await resume_image(job.job_id)
+    except (CircuitOpenError, *PROVIDER_ERRORS) as e:
+        print(f"Could not resume image job {job.job_id}: {e!r}")
+        return "failed"
+
+    [(fp, filename)] = await image_processing.prepare_uploads([imagefileobj])
+    content = f'🎨 Generated Image by {target["user_name"]}'
+    with fp:
+        file = discord.File(fp, filename=filename, spoiler=True, description=target["prompt"])
+        try:
+            if job.interaction_alive:
+                # Resolves the deferred "thinking…" response of /imagine as if the bot had never restarted
+                interaction = target["interaction"]
+                webhook = discord.Webhook.partial(interaction["application_id"], interaction["token"], client=bot)
+                try:
+                    await webhook.edit_message("@original", content=content, attachments=[file])
+                    return "delivered"
+                except discord.HTTPException as e:
+                    # Only an expired token or a deleted response falls back to the channel, other errors fail
+                    if not isinstance(e, discord.NotFound) and e.code != INVALID_WEBHOOK_TOKEN:
+                        raise
+                    file.reset()
+            channel = bot.get_channel(target["channel_id"]) or await bot.fetch_channel(target["channel_id"])
+            await channel.send(f"<@{target['user_id']}> {content}", file=file,
+                               allowed_mentions=discord.AllowedMentions(users=True))
+        except discord.HTTPException as e:
+            print(f"Could not deliver resumed image job {job.job_id}: {e!r}")
+            return "failed"
+    return "delivered"
+
+
+async def resume_image_job(job):
+    status = "failed"
+    try:
+        status = await deliver_resumed_image(job)
+    except asyncio.CancelledError:
+        # Shut down before it was delivered, the next start resumes it again
+        status = None
+        raise
+    except Exception as e:
+        print(f"\033[33mResumed image job {job.job_id} failed: {e!r}\033[0m")
+    finally:
+        # Always journaled as finished, so a job that keeps failing is not retried on every restart
+        if status is not None:
+            await job.finish(status)
+
+
+async def resume_image_jobs():
+    """Polls the image jobs a restart interrupted and delivers their images."""
+    jobs = await job_journal.load()
+    if not jobs:
+        return
+    await bot.wait_until_ready()
+    print(f"Resuming {len(jobs)} image jobs queued before the restart")
+    job_journal.resumed += len(jobs)
+    await asyncio.gather(*(resume_image_job(job) for job in jobs))
 
 
 @commands.guild_only()
@@ -258,6 +569,8 @@ async def imagine(ctx, prompt):
 @app_commands.describe(images="Choose the amount of your image.")
 @app_commands.describe(prompt="Provide a description of your imagination to turn them into image.")
 async def imagine_poly(ctx, *, prompt: str, images: int = 4):
+    if await reject_prompt(ctx, prompt):
+        return
     await ctx.defer(ephemeral=True)
     images = min(images, 18)
     tasks = []
@@ -266,44 +579,75 @@ async def imagine_poly(ctx, *, prompt: str, images: int = 4):
             task = asyncio.ensure_future(poly_image_gen(session, prompt))
             tasks.append(task)
             
-        generated_images = await asyncio.gather(*tasks)
-            
-    files = []
-    for index, image in enumerate(generated_images):
-        file = discord.File(image, filename=f"image_{index+1}.png")
-        files.append(file)
-        
-    await ctx.send(files=files, ephemeral=True)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    generated_images = [result for result in results if not isinstance(result, BaseException)]
+    if not generated_images:
+        if any(isinstance(result, CircuitOpenError) for result in results):
+            await ctx.send("⚠️ Image generation is temporarily unavailable, please try again in a little while.", ephemeral=True)
+        else:
+            await ctx.send("⚠️ Image generation failed, please try again.", ephemeral=True)
+        return
+
+    uploads = await image_processing.prepare_uploads(generated_images)
+    try:
+        files = [discord.File(fp, filename=filename) for fp, filename in uploads]
+        await ctx.send(files=files, ephemeral=True)
+    finally:
+        for fp, _ in uploads:
+            fp.close()
+
+@commands.guild_only()
+@bot.hybrid_command(name="imagine-batch", description="Generate several variations of one prompt at once")
+@app_commands.describe(prompt="Write a amazing prompt for a image")
+@app_commands.describe(count="How many variations to generate.")
+@app_commands.describe(style="The style of the images.")
+async def imagine_batch(ctx, prompt: str, count: int = 4, style: str = Style.IMAGINE_V4_Beta.name):
+    if await reject_prompt(ctx, prompt):
+        return
+    await ctx.defer()
+    count = max(1, min(count, imagine_batch_max))
+    image_style = Style.__members__.get(style, Style.IMAGINE_V4_Beta)
+    failed = 0
+    async for seed, image in imagine_client.sdprem_batch(prompt, count, imagine_batch_concurrency, style=image_style,
+                                                         reader=spool_response):
+        if image is None:
+            failed += 1
+            continue
+        [(fp, filename)] = await image_processing.prepare_uploads([image], name=f"image_{seed}")
+        with fp:
+            file = discord.File(fp, filename=filename, spoiler=True, description=prompt)
+            await ctx.send(f'🎨 Generated Image by {ctx.author.name} (seed {seed})', file=file)
+    if failed:
+        await ctx.send(f"⚠️ {failed} of {count} images could not be generated.")
+
+
+@imagine_batch.autocomplete("style")
+async def imagine_style_autocomplete(interaction, current: str):
+    return [
+        app_commands.Choice(name=name.replace("_", " ").title(), value=name)
+        for name in Style.__members__ if current.lower() in name.lower()
+    ][:25]
 
 @commands.guild_only()
 @bot.hybrid_command(name="gif", description=current_language["nekos"])
 @app_commands.choices(category=[
     app_commands.Choice(name=category.capitalize(), value=category)
-    for category in ['baka', 'bite', 'blush', 'bored', 'cry', 'cuddle', 'dance', 'facepalm', 'feed', 'handhold', 'happy', 'highfive', 'hug', 'kick', 'kiss', 'laugh', 'nod', 'nom', 'nope', 'pat', 'poke', 'pout', 'punch', 'shoot', 'shrug']
+    for category in gif_categories
 ])
 async def gif(ctx, category: app_commands.Choice[str]):
-    base_url = "https://nekos.best/api/v2/"
-
-    url = base_url + category.value
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                await ctx.channel.send("Failed to fetch the image.")
-                return
-
-            json_data = await response.json()
-
-            results = json_data.get("results")
-            if not results:
-                await ctx.channel.send("No image found.")
-                return
-
-            image_url = results[0].get("url")
+    try:
+        image_url = await gif_prefetcher.get(category.value)
+    except PROVIDER_ERRORS:
+        await ctx.channel.send("Failed to fetch the image.")
+        return
+    if not image_url:
+        await ctx.channel.send("No image found.")
+        return
 
-            embed = Embed(colour=0x141414)
-            embed.set_image(url=image_url)
-            await ctx.send(embed=embed)
+    embed = Embed(colour=0x141414)
+    embed.set_image(url=image_url)
+    await ctx.send(embed=embed)
 
 bot.remove_command("help")
 @bot.hybrid_command(name="help", description=current_language["help"])
@@ -345,6 +689,47 @@ async def server(ctx):
 
     await ctx.send(embed=embed)
 
+@bot.hybrid_command(name="status", description="Show provider health")
+@commands.is_owner()
+async def status(ctx):
+    embed = discord.Embed(title="Bot Status", color=0x03a64b)
+    for provider in ranked_providers():
+        embed.add_field(name=f"{provider.name} chat backend", value=provider.status(), inline=False)
+    for name, breaker in breakers.items():
+        embed.add_field(name=f"{name} circuit", value=breaker.status(), inline=False)
+    embed.add_field(name="Response cache", value=response_cache.status(), inline=False)
+    embed.add_field(name="Message coalescing", value=coalescer.status(), inline=False)
+    embed.add_field(name="Image downloads", value=download_budget.status(), inline=False)
+    embed.add_field(name="GIF pool", value=gif_prefetcher.status(), inline=False)
+    embed.add_field(name="Attachments", value=attachment_reader.status(), inline=False)
+    embed.add_field(name="Discord REST calls", value=rest_budget.status(), inline=False)
+    embed.add_field(name="Image jobs", value=job_journal.status(), inline=False)
+    embed.add_field(name="Prompt filter", value=f"{prompt_filter.rejected} image prompts rejected", inline=False)
+    await ctx.send(embed=embed)
+
+@bot.hybrid_command(name="profile", description="Sample the event loop and return a flamegraph-compatible profile")
+@commands.is_owner()
+@app_commands.describe(seconds="How many seconds to sample for.")
+async def profile(ctx, seconds: int = 10):
+    await ctx.defer()
+    sample_count, collapsed = await profile_loop(seconds)
+    file = discord.File(io.BytesIO(collapsed.encode()), filename="profile.folded.txt")
+    await ctx.send(f"Collected {sample_count} samples. Feed the file to flamegraph.pl or speedscope.", file=file)
+
+@bot.hybrid_command(name="memdiag", description="Show where the bot's memory goes")
+@commands.is_owner()
+@app_commands.describe(trace="Start tracemalloc, so the following reports show which code allocates more and more.")
+async def memdiag(ctx, trace: bool = False):
+    await ctx.defer()
+    if trace:
+        memory_diagnostics.start_tracing()
+    report = await memory_diagnostics.report()
+    if len(report) < 1900:
+        await ctx.send(f"```\n{report}\n```")
+    else:
+        file = discord.File(io.BytesIO(report.encode()), filename="memdiag.txt")
+        await ctx.send("Memory report:", file=file)
+
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.MissingPermissions):
@@ -352,8 +737,19 @@ async def on_command_error(ctx, error):
     elif isinstance(error, commands.NotOwner):
         await ctx.send(f"{ctx.author.mention} Only the owner of the bot can use this command.")
 
-if detect_replit():
-    from utilities.replit_flask_runner import run_flask_in_thread
-    run_flask_in_thread()
 if __name__ == "__main__":
+    # Kept under the main guard: image worker processes may import this module again
+    if detect_replit():
+        from utilities.replit_flask_runner import run_flask_in_thread
+        run_flask_in_thread()
+    if TOKEN is None:
+        TOKEN = get_discord_token()
+    else:
+        print("\033[33mLooks like the environment variables exists...\033[0m")
+        token_status = asyncio.run(check_token(TOKEN))
+        if token_status is not None:
+            TOKEN = get_discord_token()
     bot.run(TOKEN)
+    settings.close()
+    traffic_recorder.close()
+    image_processing.shutdown()
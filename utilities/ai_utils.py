@@ -1,31 +1,58 @@
 import aiohttp
-import io
 from datetime import datetime
 import re
 import asyncio
-import time
 import random
 import asyncio
 from urllib.parse import quote
 from utilities.config_loader import load_current_language, config
-import deepai as openai
+from imaginepy import AsyncImagine
+from utilities.circuit_breaker import breakers, CircuitOpenError, ProviderError, PROVIDER_ERRORS
+from utilities.chat_providers import chat_completion, AllProvidersFailed
+from utilities.deadline import Deadline, DeadlineExceeded, generation_min_budget, send_budget
+from utilities.image_buffer import spool_response
+from utilities import json_codec
+from utilities.prompt_serializer import PromptSerializer
 current_language = load_current_language()
 internet_access = config['INTERNET_ACCESS']
 
-async def search(prompt):
+# Provider endpoints, kept in one place so they can be pointed at local stubs (see benchmarks/)
+SEARCH_API_URL = 'https://ddg-api.herokuapp.com/search'
+POLLINATIONS_URL = 'https://image.pollinations.ai/prompt'
+PRODIA_API_URL = 'https://api.prodia.com'
+PRODIA_IMAGE_URL = 'https://images.prodia.xyz'
+NEKOS_API_URL = 'https://nekos.best/api/v2'
+
+prodia_job_timeout = config.get('PRODIA_JOB_TIMEOUT', 120)
+
+# One long-lived Imagine client for the whole bot, its session is created on first use
+imagine_client = AsyncImagine()
+
+# Caches the encoded history turns of each conversation between requests
+prompt_serializer = PromptSerializer()
+
+def wants_search(prompt):
+    """Whether search() looks the prompt up at all, before the budget or the provider have a say."""
+    return internet_access and len(prompt) <= 200
+
+async def search(prompt, deadline=None):
     """
     Asynchronously searches for a prompt and returns the search results as a blob.
 
     Args:
         prompt (str): The prompt to search for.
+        deadline (Deadline): The reply's time budget. The search is skipped when it would
+            leave less than GENERATION_MIN_BUDGET seconds for the reply itself.
 
     Returns:
         str: The search results as a blob.
 
     Raises:
-        None
+        None. The search is skipped (None is returned) when the provider fails or its circuit breaker is open.
     """
-    if not internet_access or len(prompt) > 200:
+    if not wants_search(prompt):
+        return
+    if deadline is not None and not deadline.allows(generation_min_budget + 1):
         return
     search_results_limit = config['MAX_SEARCH_RESULTS']
 
@@ -41,13 +68,32 @@ async def search(prompt):
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     blob = f"Search results for: '{search_query}' at {current_time}:\n"
     if search_query is not None:
+        breaker = breakers['search']
+        timeout = breaker.timeout
+        if deadline is not None:
+            timeout = aiohttp.ClientTimeout(total=deadline.timeout(timeout.total, reserve=generation_min_budget),
+                                            sock_connect=timeout.sock_connect, sock_read=timeout.sock_read)
+        cut_short = timeout.total < breaker.timeout.total
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get('https://ddg-api.herokuapp.com/search',
-                                       params={'query': search_query, 'limit': search_results_limit}) as response:
-                    search = await response.json()
-        except aiohttp.ClientError as e:
-            print(f"An error occurred during the search request: {e}")
+            async with breaker:
+                try:
+                    async with aiohttp.ClientSession(timeout=timeout) as session:
+                        async with session.get(SEARCH_API_URL, raise_for_status=True,
+                                               params={'query': search_query, 'limit': search_results_limit}) as response:
+                            search = await response.json(loads=json_codec.loads)
+                except asyncio.TimeoutError as e:
+                    # Ran out of the reply's budget before the provider's own timeouts: not the provider's fault,
+                    # so it is not counted against its breaker (socket timeouts still are)
+                    if cut_short and not isinstance(e, aiohttp.ServerTimeoutError):
+                        raise DeadlineExceeded(f"Search cut short after {timeout.total:.2f}s by the reply budget") from None
+                    raise
+        except CircuitOpenError:
+            return
+        except DeadlineExceeded as e:
+            print(e)
+            return
+        except PROVIDER_ERRORS as e:
+            print(f"An error occurred during the search request: {e!r}")
             return
 
         for index, result in enumerate(search):
@@ -62,47 +108,76 @@ async def search(prompt):
     return blob
     
 
-async def generate_response(instructions, search, history, filecontent):
+async def generate_response(instructions, search, history, filecontent, deadline=None, summary=None,
+                            conversation=None):
+    """
+    Generates a chat reply using the configured chat backends (see CHAT_BACKENDS).
+
+    Args:
+        deadline (Deadline): The reply's time budget, SEND_BUDGET seconds of it are left for sending.
+        summary (str): Rolling summary of the turns that were compacted out of the history.
+        conversation (str): Key of the conversation, so its already encoded turns are reused.
+
+    Returns:
+        str: The reply, or None when every backend failed or the budget ran out.
+    """
     if filecontent is None:
         filecontent = 'No extra files sent.'
     if search is not None:
         search_results = search
     elif search is None:
         search_results = "Search feature is disabled"
-    messages = [
+    messages = prompt_serializer.serialize(
+        conversation,
+        [
             {"role": "system", "name": "instructions", "content": instructions},
-            *history,
+            *([{"role": "system", "name": "conversation_summary", "content": summary}] if summary else []),
+        ],
+        history,
+        [
             {"role": "system", "name": "file_content", "content": filecontent},
             {"role": "system", "name": "search_results", "content": search_results},
-        ]
-    response = "​"
-    timeout = 300  # Timeout in seconds
-    start_time = time.time()
-    while True:
-        try:
-            for chunk in openai.ChatCompletion.create(messages):
-                response += chunk
-        except:
-            pass
-        if time.time() - start_time >= timeout:
-            break
-        break
-    return response
+        ])
+    if deadline is None:
+        deadline = Deadline()
+    try:
+        return await deadline.run(chat_completion(messages), reserve=send_budget)
+    except AllProvidersFailed as e:
+        print(f"No chat backend produced a reply: {e}")
+        return None
+    except DeadlineExceeded:
+        print(f"No reply was generated within the {deadline.budget}s reply budget")
+        return None
+
+async def fetch_gifs(session, category, amount=1):
+    """
+    Fetches GIF URLs of one category from nekos.best.
+
+    Args:
+        amount (int): How many results to ask for, the API returns at most 20 per call.
+
+    Returns:
+        list: The GIF URLs, possibly empty.
+    """
+    async with session.get(f"{NEKOS_API_URL}/{category}", params={"amount": amount},
+                           timeout=aiohttp.ClientTimeout(total=10), raise_for_status=True) as response:
+        json_data = await response.json(loads=json_codec.loads)
+        return [result["url"] for result in json_data.get("results") or [] if result.get("url")]
 
 async def poly_image_gen(session, prompt):
     seed = random.randint(1, 100000)
-    image_url = f"https://image.pollinations.ai/prompt/{prompt}{seed}"
-    async with session.get(image_url) as response:
-        image_data = await response.read()
-        image_io = io.BytesIO(image_data)
-        return image_io
+    image_url = f"{POLLINATIONS_URL}/{prompt}{seed}"
+    breaker = breakers['pollinations']
+    async with breaker:
+        async with session.get(image_url, timeout=breaker.timeout, raise_for_status=True) as response:
+            return await spool_response(response)
         
 async def generate_job(prompt, seed=None):
     print("Got here too")
     if seed is None:
       seed = random.randint(10000, 99999)
     
-    url = 'https://api.prodia.com/generate'
+    url = f'{PRODIA_API_URL}/generate'
     params = {
         'new': 'true',
         'prompt': f'{quote(prompt)}',
@@ -131,26 +206,55 @@ async def generate_job(prompt, seed=None):
         'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36',
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params, headers=headers) as response:
-            data = await response.json()
+    async with aiohttp.ClientSession(timeout=breakers['prodia'].timeout) as session:
+        async with session.get(url, params=params, headers=headers, raise_for_status=True) as response:
+            data = await response.json(loads=json_codec.loads)
             return data['job']
 
-async def generate_image(prompt):
-    job_id = await generate_job(prompt)
-    url = f'https://api.prodia.com/job/{job_id}'
+async def poll_job(job_id):
+    url = f'{PRODIA_API_URL}/job/{job_id}'
     headers = {
         'authority': 'api.prodia.com',
         'accept': '*/*',
     }
 
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(timeout=breakers['prodia'].timeout) as session:
         while True:
             await asyncio.sleep(0.3)
-            async with session.get(url, headers=headers) as response:
-                json = await response.json()
+            async with session.get(url, headers=headers, raise_for_status=True) as response:
+                json = await response.json(loads=json_codec.loads)
+                if json['status'] == 'failed':
+                    raise ProviderError(f"Prodia job {job_id} failed")
                 if json['status'] == 'succeeded':
-                    async with session.get(f'https://images.prodia.xyz/{job_id}.png?download=1', headers=headers) as response:
-                        content = await response.content.read()
-                        img_file_obj = io.BytesIO(content)
-                        return img_file_obj
+                    async with session.get(f'{PRODIA_IMAGE_URL}/{job_id}.png?download=1', headers=headers,
+                                           raise_for_status=True) as response:
+                        return await spool_response(response)
+
+async def generate_image(prompt, on_queued=None):
+    """
+    Generates an image with Prodia.
+
+    Args:
+        on_queued (coroutine function): Awaited with the Prodia job id once the job is queued,
+            so it can be journaled and resumed after a restart.
+
+    Returns:
+        ImageSpool: The image, spooled to disk if it is large. The caller closes it.
+
+    Raises:
+        CircuitOpenError: Prodia has been failing and is not being called right now.
+        ProviderError, aiohttp.ClientError, asyncio.TimeoutError: The generation failed,
+            did not finish within PRODIA_JOB_TIMEOUT or sent an image over IMAGE_MAX_MB.
+    """
+    async with breakers['prodia']:
+        job_id = await generate_job(prompt)
+        if on_queued is not None:
+            await on_queued(job_id)
+        return await asyncio.wait_for(poll_job(job_id), prodia_job_timeout)
+
+async def resume_image(job_id):
+    """
+    Waits for a Prodia job queued before a restart and returns its image, like generate_image().
+    """
+    async with breakers['prodia']:
+        return await asyncio.wait_for(poll_job(job_id), prodia_job_timeout)
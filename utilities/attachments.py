@@ -0,0 +1,169 @@
+import asyncio
+import collections
+import hashlib
+import os
+
+import aiohttp
+
+from utilities.config_loader import config
+
+attachment_max_kb = config.get('ATTACHMENT_MAX_KB', 256)
+attachment_max_chars = config.get('ATTACHMENT_MAX_CHARS', 8000)
+attachment_concurrency = config.get('ATTACHMENT_CONCURRENCY', 4)
+attachment_cache_entries = config.get('ATTACHMENT_CACHE_ENTRIES', 256)
+
+TEXT_EXTENSIONS = {
+    ".txt", ".md", ".rst", ".log", ".csv", ".tsv", ".json", ".jsonl", ".yml", ".yaml", ".toml", ".ini", ".cfg",
+    ".xml", ".html", ".css", ".sql", ".py", ".js", ".ts", ".jsx", ".tsx", ".java", ".kt", ".c", ".h", ".cpp",
+    ".hpp", ".cs", ".go", ".rs", ".rb", ".php", ".lua", ".sh", ".bat", ".ps1", ".swift",
+}
+CHUNK_SIZE = 16 * 1024
+TRUNCATED = "\n[... truncated]"
+
+
+def is_text_attachment(attachment):
+    extension = os.path.splitext(attachment.filename)[1].lower()
+    content_type = (attachment.content_type or "").split(";")[0]
+    return extension in TEXT_EXTENSIONS or content_type.startswith("text/")
+
+
+def extract_text(data, truncated, max_chars):
+    """Decodes the start of a text file and cuts it to max_chars. Returns None for binary data."""
+    if b"\x00" in data[:1024]:
+        return None
+    text = data.decode("utf-8-sig", errors="replace").replace("\r\n", "\n")
+    if truncated:
+        # The download stopped mid-file, drop the last partial line
+        text = text.rsplit("\n", 1)[0]
+    if len(text) > max_chars:
+        text, truncated = text[:max_chars], True
+    return text + TRUNCATED if truncated else text
+
+
+class AttachmentReader:
+    """
+    Reads text-like attachments so their content can be given to the model.
+
+    Downloads are streamed and stop after ATTACHMENT_MAX_KB, so a huge log costs no more
+    than a small one, and at most ATTACHMENT_CONCURRENCY run at once. Decoding happens in
+    a worker thread. Extracted text is cached by the hash of the downloaded bytes. An
+    attachment read again (e.g. when a burst of messages is regenerated) is found by its
+    id without a request. A file sent again as a new attachment is found by its size and
+    the ETag the CDN sends with the response headers, and its body is not downloaded;
+    without an ETag it is downloaded again but not decoded twice.
+    """
+
+    def __init__(self, max_kb=attachment_max_kb, max_chars=attachment_max_chars,
+                 concurrency=attachment_concurrency, cache_entries=attachment_cache_entries):
+        self.max_bytes = max_kb * 1024
+        self.max_chars = max_chars
+        self.cache_entries = cache_entries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._texts = collections.OrderedDict()
+        self._hashes = collections.OrderedDict()
+        self._session = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=20))
+        return self._session
+
+    def _remember(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.cache_entries:
+            entries.popitem(last=False)
+
+    def _cached(self, key):
+        digest = self._hashes.get(key)
+        if digest is None or digest not in self._texts:
+            return None
+        self.hits += 1
+        self._texts.move_to_end(digest)
+        return digest
+
+    async def _read_body(self, response):
+        """Returns the first max_bytes of the response and whether the file goes on after them."""
+        data = bytearray()
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            data += chunk
+            if len(data) > self.max_bytes:
+                return bytes(data[:self.max_bytes]), True
+        return bytes(data), False
+
+    async def read(self, attachment):
+        """
+        Returns the text of one attachment, or None when it is not a text file.
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: The download failed.
+        """
+        if not is_text_attachment(attachment):
+            return None
+        digest = self._cached(attachment.id)
+        if digest is not None:
+            return self._texts[digest]
+        async with self._semaphore:
+            async with self.session.get(attachment.url, raise_for_status=True) as response:
+                etag = response.headers.get("ETag")
+                content_key = (attachment.size, etag) if etag else None
+                digest = self._cached(content_key) if content_key else None
+                if digest is not None:
+                    # Leaving the request here closes it before the body is read
+                    self._remember(self._hashes, attachment.id, digest)
+                    return self._texts[digest]
+                data, truncated = await self._read_body(response)
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        self._remember(self._hashes, attachment.id, digest)
+        if content_key:
+            self._remember(self._hashes, content_key, digest)
+        if digest in self._texts:
+            self.hits += 1
+            self._texts.move_to_end(digest)
+            return self._texts[digest]
+        self.misses += 1
+        text = await asyncio.to_thread(extract_text, data, truncated, self.max_chars)
+        self._remember(self._texts, digest, text)
+        return text
+
+    async def file_content(self, attachments):
+        """
+        Builds the file_content prompt section for the attachments of a message burst.
+
+        Files that cannot be read are still mentioned by name, and the combined text is
+        kept around ATTACHMENT_MAX_CHARS.
+        """
+        results = await asyncio.gather(*(self.read(attachment) for attachment in attachments),
+                                       return_exceptions=True)
+        # Share the character budget evenly, shortest files first, so what a short file
+        # does not use goes to the longer ones and one long file cannot crowd out the rest
+        shares = {}
+        budget = self.max_chars
+        texts = sorted((index for index, text in enumerate(results) if isinstance(text, str)),
+                       key=lambda index: len(results[index]))
+        for position, index in enumerate(texts):
+            shares[index] = min(len(results[index]), budget // (len(texts) - position))
+            budget -= shares[index]
+
+        sections = []
+        for index, (attachment, text) in enumerate(zip(attachments, results)):
+            if isinstance(text, BaseException):
+                print(f"\033[33mCould not read attachment {attachment.filename}: {text!r}\033[0m")
+                sections.append(f"The user has sent a file ({attachment.filename}) that could not be downloaded.")
+            elif text is None:
+                sections.append(f"The user has sent a file ({attachment.filename}) that is not a text file.")
+            else:
+                if len(text) > shares[index]:
+                    text = text[:shares[index]] + TRUNCATED
+                sections.append(f"The user has sent the file {attachment.filename}:\n```\n{text}\n```")
+        return "\n\n".join(sections)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def status(self):
+        return f"{len(self._texts)} files cached, {self.hits} hits, {self.misses} read"
@@ -0,0 +1,198 @@
+import abc
+import asyncio
+import os
+import time
+
+import aiohttp
+
+import deepai
+from utilities import json_codec
+from utilities.config_loader import config
+from utilities.prompt_serializer import encode_messages
+
+chat_backends = config.get('CHAT_BACKENDS', ['deepai'])
+hedge_delay = config.get('HEDGE_DELAY', 2.5)
+openai_compatible = config.get('OPENAI_COMPATIBLE', {})
+
+# Weight of the newest observation in the health averages
+HEALTH_SMOOTHING = 0.3
+
+
+class AllProvidersFailed(Exception):
+    """Raised when every configured chat backend failed to produce a reply."""
+
+
+class PartialReply(str):
+    """A reply whose stream broke off, holding the text that arrived before the break."""
+
+
+class ChatProvider(abc.ABC):
+    """
+    Base class for chat backends.
+
+    Subclasses implement stream(), an async generator that yields the reply in text
+    chunks. The provider keeps a health score made of exponentially weighted averages
+    of its success rate and time to first byte, which is used to order the backends.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.success_rate = 1.0
+        self.first_byte_latency = 0.0
+
+    @abc.abstractmethod
+    def stream(self, messages):
+        """An async generator that yields the reply to the messages in text chunks."""
+
+    def record_first_byte(self, latency):
+        self.first_byte_latency += HEALTH_SMOOTHING * (latency - self.first_byte_latency)
+
+    def record_outcome(self, success):
+        self.success_rate += HEALTH_SMOOTHING * (float(success) - self.success_rate)
+
+    def score(self):
+        return self.success_rate / (1 + self.first_byte_latency)
+
+    def status(self):
+        return f"score {self.score():.2f}, {self.success_rate:.0%} healthy, first byte {self.first_byte_latency:.2f}s"
+
+
+class DeepAIProvider(ChatProvider):
+    name = "deepai"
+
+    async def stream(self, messages):
+        async for chunk in deepai.ChatCompletion.acreate(messages, serialized=encode_messages(messages)):
+            yield chunk
+
+
+class OpenAICompatibleProvider(ChatProvider):
+    """Any endpoint that speaks the OpenAI chat completions API with server-sent events."""
+
+    name = "openai"
+
+    def __init__(self, url, model, api_key):
+        super().__init__()
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+
+    async def stream(self, messages):
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        headers["Content-Type"] = "application/json"
+        # The messages usually arrive already encoded, the rest of the body is put around them
+        body = b'{"model":' + json_codec.dumpb(self.model) + b',"stream":true,"messages":' + encode_messages(messages) + b'}'
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.url, data=body, headers=headers, raise_for_status=True) as response:
+                async for line in response.content:
+                    line = line.decode().strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    choices = json_codec.loads(data).get("choices") or [{}]
+                    content = choices[0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+
+
+def _build_provider(name):
+    if name == "deepai":
+        return DeepAIProvider()
+    if name == "openai":
+        return OpenAICompatibleProvider(
+            openai_compatible.get('URL', 'https://api.openai.com/v1/chat/completions'),
+            openai_compatible.get('MODEL', 'gpt-3.5-turbo'),
+            os.getenv('OPENAI_API_KEY'))
+    raise ValueError(f"Unknown chat backend '{name}' in CHAT_BACKENDS")
+
+
+providers = [_build_provider(name) for name in chat_backends]
+
+
+def ranked_providers():
+    """Providers ordered by health score; ties keep the CHAT_BACKENDS order."""
+    return sorted(providers, key=lambda provider: provider.score(), reverse=True)
+
+
+async def _first_chunk(provider, messages):
+    started = time.monotonic()
+    stream = provider.stream(messages)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        raise aiohttp.ClientPayloadError(f"{provider.name} returned an empty reply")
+    provider.record_first_byte(time.monotonic() - started)
+    return stream, first
+
+
+async def _start_hedged(messages):
+    """
+    Starts the best backend and, if it has not produced a first byte within
+    HEDGE_DELAY, the next one as well. The first stream to start wins and the
+    others are cancelled. A backend that fails right away is replaced immediately.
+    """
+    candidates = ranked_providers()
+    pending = {}
+    errors = []
+
+    def launch_next():
+        provider = candidates.pop(0)
+        pending[asyncio.create_task(_first_chunk(provider, messages))] = provider
+
+    try:
+        launch_next()
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay if candidates else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch_next()
+                continue
+            winner = None
+            for task in done:
+                provider = pending.pop(task)
+                if task.exception() is not None:
+                    provider.record_outcome(False)
+                    errors.append(f"{provider.name}: {task.exception()!r}")
+                elif winner is None:
+                    winner = (provider, *task.result())
+                else:
+                    await task.result()[0].aclose()
+            if winner is not None:
+                return winner
+            if not pending and candidates:
+                launch_next()
+    finally:
+        for task in pending:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                # Started too after the winner was picked, cancel() would not close its stream
+                await task.result()[0].aclose()
+    raise AllProvidersFailed("; ".join(errors))
+
+
+async def chat_completion(messages):
+    """
+    Streams a reply for the messages from the configured chat backends.
+
+    Returns:
+        str: The full reply, or a PartialReply with the start of it when the stream broke off.
+
+    Raises:
+        AllProvidersFailed: No backend produced a reply.
+    """
+    provider, stream, first = await _start_hedged(messages)
+    chunks = [first]
+    try:
+        async for chunk in stream:
+            chunks.append(chunk)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Keep what was already streamed rather than dropping the whole reply
+        print(f"{provider.name} stream broke off: {e!r}")
+        provider.record_outcome(False)
+        return PartialReply("".join(chunks))
+    else:
+        provider.record_outcome(True)
+    return "".join(chunks)
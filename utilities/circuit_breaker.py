@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import time
+
+import aiohttp
+
+from utilities.config_loader import config
+
+failure_rate_threshold = config.get('CIRCUIT_BREAKER_FAILURE_RATE', 0.5)
+window_size = config.get('CIRCUIT_BREAKER_WINDOW', 20)
+minimum_calls = config.get('CIRCUIT_BREAKER_MIN_CALLS', 5)
+cooldown = config.get('CIRCUIT_BREAKER_COOLDOWN', 30)
+provider_timeouts = config.get('PROVIDER_TIMEOUTS', {})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class ProviderError(Exception):
+    """Raised when a provider answers, but with something unusable (e.g. a failed job)."""
+
+
+# Exceptions that count against a provider's health; anything else is treated as our own bug
+PROVIDER_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ProviderError)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose breaker is open."""
+
+    def __init__(self, name):
+        super().__init__(f"{name} is temporarily unavailable")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Tracks the recent failure rate of one provider and fails fast while it is unhealthy.
+
+    The breaker opens when at least `minimum_calls` of the last `window_size` calls were
+    made and the share of failures reaches the threshold. After the cooldown, a single
+    probe call is let through (half-open); its outcome closes or re-opens the breaker.
+
+    Use it as an async context manager around each provider call:
+
+        async with breakers['search']:
+            ...
+    """
+
+    def __init__(self, name, connect_timeout=3, read_timeout=10):
+        self.name = name
+        self.timeout = aiohttp.ClientTimeout(total=connect_timeout + read_timeout,
+                                             sock_connect=connect_timeout, sock_read=read_timeout)
+        self.state = CLOSED
+        self.outcomes = collections.deque(maxlen=window_size)
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.rejected = 0
+
+    def _transition(self, state):
+        if state != self.state:
+            print(f"\033[33mCircuit breaker for {self.name}: {self.state} -> {state}\033[0m")
+            self.state = state
+
+    def failure_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def allow(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= cooldown:
+            self._transition(HALF_OPEN)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, success):
+        if self.state == HALF_OPEN:
+            self.probe_in_flight = False
+            if success:
+                self.outcomes.clear()
+                self._transition(CLOSED)
+            else:
+                self.opened_at = time.monotonic()
+                self._transition(OPEN)
+            return
+        self.outcomes.append(success)
+        if len(self.outcomes) >= minimum_calls and self.failure_rate() >= failure_rate_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(OPEN)
+
+    async def __aenter__(self):
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.record(True)
+        elif issubclass(exc_type, PROVIDER_ERRORS):
+            self.record(False)
+        elif self.state == HALF_OPEN:
+            # Cancelled or failed on our side, let the next call probe instead
+            self.probe_in_flight = False
+        return False
+
+    def status(self):
+        status = f"{self.state}, {self.failure_rate():.0%} of last {len(self.outcomes)} calls failed"
+        if self.state == OPEN:
+            retry_in = max(0, cooldown - (time.monotonic() - self.opened_at))
+            status += f", probing again in {retry_in:.0f}s"
+        if self.rejected:
+            status += f", {self.rejected} calls rejected"
+        return status
+
+
+def _build_breaker(name, connect_timeout, read_timeout):
+    timeouts = provider_timeouts.get(name, {})
+    return CircuitBreaker(name, timeouts.get('connect', connect_timeout), timeouts.get('read', read_timeout))
+
+
+breakers = {
+    'search': _build_breaker('search', 2, 4),
+    'prodia': _build_breaker('prodia', 3, 15),
+    'pollinations': _build_breaker('pollinations', 3, 60),
+}
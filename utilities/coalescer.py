@@ -0,0 +1,83 @@
+import asyncio
+import traceback
+
+from utilities.config_loader import config
+
+coalesce_window = config.get('COALESCE_WINDOW', 1.0)
+
+
+class _Conversation:
+    def __init__(self):
+        self.pending = []
+        self.task = None
+        self.replying_task = None
+
+
+class MessageCoalescer:
+    """
+    Turns bursts of messages in one conversation into a single generation.
+
+    Every message restarts a short debounce window, and a generation that has not yet
+    started replying is cancelled and redone with the new message included. Once the
+    handler calls commit(), the batch is final: later messages wait for that reply to
+    be sent before their own generation starts, so history stays in order.
+
+    The handler is called as handler(key, messages, commit) and must call commit()
+    right before it changes any shared state (history, replies).
+    """
+
+    def __init__(self, handler, window=coalesce_window):
+        self.handler = handler
+        self.window = window
+        self._conversations = {}
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def submit(self, key, message):
+        conversation = self._conversations.setdefault(key, _Conversation())
+        if conversation.pending:
+            self.coalesced += 1
+        conversation.pending.append(message)
+        task = conversation.task
+        if task is not None and not task.done() and task is not conversation.replying_task:
+            self.cancelled += 1
+            task.cancel()
+        conversation.task = asyncio.create_task(self._run(key, conversation))
+
+    async def _run(self, key, conversation):
+        current = asyncio.current_task()
+        try:
+            await asyncio.sleep(self.window)
+            if conversation.replying_task is not None:
+                await asyncio.wait({conversation.replying_task})
+            batch = list(conversation.pending)
+
+            def commit():
+                del conversation.pending[:len(batch)]
+                conversation.replying_task = current
+
+            await self.handler(key, batch, commit)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            if conversation.replying_task is current:
+                conversation.replying_task = None
+            if conversation.task is current and not conversation.pending and self._conversations.get(key) is conversation:
+                del self._conversations[key]
+
+    async def wait_idle(self, key=None):
+        """Waits until the conversation (or every conversation) has no pending work."""
+        while True:
+            if key is None:
+                tasks = [conversation.task for conversation in self._conversations.values()]
+            else:
+                conversation = self._conversations.get(key)
+                tasks = [conversation.task] if conversation is not None else []
+            tasks = [task for task in tasks if task is not None and not task.done()]
+            if not tasks:
+                return
+            await asyncio.wait(tasks)
+
+    def status(self):
+        return (f"{len(self._conversations)} active conversations, {self.coalesced} messages coalesced, "
+                f"{self.cancelled} generations superseded")
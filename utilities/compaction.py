@@ -0,0 +1,72 @@
+import asyncio
+
+from utilities.chat_providers import chat_completion, AllProvidersFailed
+from utilities.config_loader import config
+
+compaction_enabled = config.get('HISTORY_COMPACTION', False)
+compaction_threshold = config.get('COMPACTION_THRESHOLD', config['MAX_HISTORY'])
+compaction_keep_turns = config.get('COMPACTION_KEEP_TURNS', 4)
+compaction_timeout = config.get('COMPACTION_TIMEOUT', 60)
+
+SUMMARY_INSTRUCTIONS = ("Summarize the conversation below for your own future reference. Keep names, facts, "
+                        "preferences, open questions and anything the user asked you to remember. "
+                        "Merge it with the previous summary if there is one. Answer with the summary only, "
+                        "in under 150 words.")
+
+
+def _transcript(turns):
+    return "\n".join(f"{turn.get('name', turn['role'])}: {turn['content']}" for turn in turns)
+
+
+class ConversationCompactor:
+    """
+    Folds old turns of each conversation into one rolling summary.
+
+    Compaction runs as a background task after a reply has been sent. Once the summary
+    is ready, the turns it covers are removed from the history, and the summary is
+    sent with later requests instead.
+    """
+
+    def __init__(self, histories, enabled=compaction_enabled):
+        self.histories = histories
+        self.enabled = enabled
+        self.summaries = {}
+        self._running = {}
+
+    def summary_for(self, key):
+        return self.summaries.get(key)
+
+    def forget(self, key):
+        self.summaries.pop(key, None)
+        task = self._running.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def schedule(self, key):
+        """Starts compacting the conversation if it is long enough and not already being compacted."""
+        if not self.enabled or key in self._running:
+            return
+        if len(self.histories.get(key, [])) <= compaction_threshold:
+            return
+        task = asyncio.create_task(self._compact(key))
+        self._running[key] = task
+        task.add_done_callback(lambda _: self._running.pop(key, None))
+
+    async def _compact(self, key):
+        old_turns = self.histories[key][:-compaction_keep_turns]
+        if not old_turns:
+            return
+        previous = self.summaries.get(key)
+        request = [{"role": "system", "name": "instructions", "content": SUMMARY_INSTRUCTIONS}]
+        if previous:
+            request.append({"role": "system", "name": "previous_summary", "content": previous})
+        request.append({"role": "user", "content": _transcript(old_turns)})
+        try:
+            summary = await asyncio.wait_for(chat_completion(request), compaction_timeout)
+        except (AllProvidersFailed, asyncio.TimeoutError) as e:
+            print(f"Could not compact conversation {key}: {e!r}")
+            return
+        self.summaries[key] = summary.strip()
+        # The history may have been trimmed or grown meanwhile, so drop exactly the turns that were summarized
+        summarized = {id(turn) for turn in old_turns}
+        self.histories[key] = [turn for turn in self.histories.get(key, []) if id(turn) not in summarized]
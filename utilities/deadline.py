@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+from utilities.config_loader import config
+
+reply_sla = config.get('REPLY_SLA', 60)
+send_budget = config.get('SEND_BUDGET', 5)
+generation_min_budget = config.get('GENERATION_MIN_BUDGET', 15)
+cosmetic_min_budget = config.get('COSMETIC_MIN_BUDGET', 10)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage runs out of the time left in its deadline."""
+
+
+class Deadline:
+    """
+    A time budget shared by every stage of one reply.
+
+    Each stage sizes its own timeout from what is left, so a slow search eats into
+    the generation budget instead of pushing the reply past the SLA.
+    """
+
+    def __init__(self, budget=reply_sla):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows(self, seconds):
+        """Whether at least `seconds` of the budget are left, used to skip optional work."""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap=None, reserve=0.0):
+        """Seconds a stage may take, keeping `reserve` seconds back for the stages after it."""
+        timeout = self.remaining() - reserve
+        if cap is not None:
+            timeout = min(timeout, cap)
+        return max(0.0, timeout)
+
+    async def run(self, awaitable, cap=None, reserve=0.0, floor=0.0):
+        """
+        Awaits within the stage's share of the budget.
+
+        Args:
+            cap (float): Upper bound for this stage regardless of the budget.
+            reserve (float): Seconds to leave for later stages.
+            floor (float): Minimum time to allow even when the budget is spent (e.g. for sending a failure notice).
+
+        Raises:
+            DeadlineExceeded: The stage did not finish in time.
+        """
+        timeout = max(self.timeout(cap, reserve), floor)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Stage ran out of time after {timeout:.2f}s") from None
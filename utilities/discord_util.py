@@ -1,7 +1,33 @@
 import discord
 from discord.ext import commands
 
-intents = discord.Intents.all()
+from utilities.config_loader import config
+
+lean_cache = config.get('LEAN_CACHE', False)
+
+
+def bot_options(lean=lean_cache):
+    """
+    Returns the intents and cache options for commands.Bot.
+
+    Lean mode only asks for what the bot's features use: guild messages and DMs with their
+    content, but no member list, presences or typing events. No members are cached and
+    guilds are not chunked at startup, so memory and gateway traffic no longer grow with
+    the size of the guilds. Member lookups are done on demand instead (see /changeusr).
+    """
+    if not lean:
+        return {"intents": discord.Intents.all()}
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.typing = False
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+    }
+
+
+intents = bot_options()["intents"]
 
 async def check_token(TOKEN):
     try:
@@ -0,0 +1,91 @@
+import asyncio
+import collections
+
+import aiohttp
+
+from utilities import ai_utils
+from utilities.circuit_breaker import PROVIDER_ERRORS
+from utilities.config_loader import config
+
+gif_pool_size = config.get('GIF_POOL_SIZE', 10)
+gif_pool_low_water = config.get('GIF_POOL_LOW_WATER', 3)
+
+# nekos.best returns at most this many results per request
+MAX_AMOUNT = 20
+
+
+class GifPrefetcher:
+    """
+    Keeps a small pool of GIF URLs for every /gif category, so the command answers from memory.
+
+    The pools are filled in the background when the bot starts, and a pool is topped up
+    again as soon as it falls below GIF_POOL_LOW_WATER. Each URL is handed out once.
+    When a pool is empty, get() fetches a single URL live instead.
+    """
+
+    def __init__(self, categories, size=gif_pool_size, low_water=gif_pool_low_water):
+        self.size = min(size, MAX_AMOUNT)
+        self.low_water = low_water
+        self.pools = {category: collections.deque() for category in categories}
+        self.hits = 0
+        self.misses = 0
+        self._refilling = {}
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    def start(self):
+        """Fills every pool in the background. Needs a running event loop."""
+        for category in self.pools:
+            self._refill(category)
+
+    def _refill(self, category):
+        if not self.size or category in self._refilling:
+            return
+        task = asyncio.create_task(self._fill(category))
+        self._refilling[category] = task
+        task.add_done_callback(lambda _: self._refilling.pop(category, None))
+
+    async def _fill(self, category):
+        pool = self.pools[category]
+        try:
+            pool.extend(await ai_utils.fetch_gifs(self.session, category, self.size - len(pool)))
+        except PROVIDER_ERRORS as e:
+            print(f"\033[33mCould not prefetch {category} GIFs: {e!r}\033[0m")
+
+    async def get(self, category):
+        """
+        Returns a GIF URL for the category, or None if nekos.best has none.
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: The pool was empty and the live fetch failed.
+        """
+        pool = self.pools[category]
+        if len(pool) <= self.low_water:
+            self._refill(category)
+        if pool:
+            self.hits += 1
+            return pool.popleft()
+        self.misses += 1
+        urls = await ai_utils.fetch_gifs(self.session, category)
+        return urls[0] if urls else None
+
+    async def wait_filled(self):
+        """Waits for the refills in progress to finish."""
+        if self._refilling:
+            await asyncio.wait(list(self._refilling.values()))
+
+    async def close(self):
+        for task in list(self._refilling.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+    def status(self):
+        stocked = sum(len(pool) for pool in self.pools.values())
+        return (f"{stocked} GIFs ready across {len(self.pools)} categories, "
+                f"{self.hits} served from the pool, {self.misses} fetched live")
@@ -0,0 +1,189 @@
+import asyncio
+import collections
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+from utilities.config_loader import config
+
+settings_db = config.get('SETTINGS_DB', 'settings.db')
+settings_flush_delay = config.get('SETTINGS_FLUSH_DELAY', 2)
+
+LEGACY_CHANNELS_FILE = "channels.txt"
+RATE_LIMIT_WINDOW = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS active_channels (channel_id INTEGER PRIMARY KEY, guild_id INTEGER);
+CREATE TABLE IF NOT EXISTS guild_settings (guild_id INTEGER PRIMARY KEY, triggers TEXT, persona TEXT,
+                                           rate_limit INTEGER);
+CREATE TABLE IF NOT EXISTS bot_settings (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class GuildConfig:
+    """Per-guild overrides. None means the global setting from config.yml applies."""
+
+    __slots__ = ("triggers", "persona", "rate_limit")
+
+    def __init__(self, triggers=None, persona=None, rate_limit=None):
+        self.triggers = triggers
+        self.persona = persona
+        self.rate_limit = rate_limit
+
+    def is_default(self):
+        return self.triggers is None and self.persona is None and not self.rate_limit
+
+
+class SettingsStore:
+    """
+    Active channels, per-guild overrides and bot-wide toggles, kept in SQLite.
+
+    Everything is read into memory once at startup, so lookups are plain set and dict
+    accesses. Changes update memory immediately and are written in batches: the rows a
+    change touches are marked dirty, and a background task writes all of them in one
+    transaction SETTINGS_FLUSH_DELAY seconds later, in a worker thread.
+    """
+
+    def __init__(self, path=settings_db, flush_delay=settings_flush_delay):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.active_channels = set()
+        self.guilds = {}
+        self.bot_settings = {}
+        self._dirty = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.executescript(SCHEMA)
+            yield connection
+
+    def load(self):
+        """Reads every setting into memory, importing channels.txt the first time. Blocking, call it at startup."""
+        with self._transaction() as connection:
+            self.active_channels.update(row[0] for row in connection.execute("SELECT channel_id FROM active_channels"))
+            for guild_id, triggers, persona, rate_limit in connection.execute("SELECT * FROM guild_settings"):
+                self.guilds[guild_id] = GuildConfig(json.loads(triggers) if triggers else None, persona, rate_limit)
+            self.bot_settings.update((key, json.loads(value))
+                                     for key, value in connection.execute("SELECT * FROM bot_settings"))
+            if os.path.exists(LEGACY_CHANNELS_FILE):
+                with open(LEGACY_CHANNELS_FILE) as f:
+                    legacy = {int(line) for line in f if line.strip()}
+                connection.executemany("INSERT OR IGNORE INTO active_channels (channel_id) VALUES (?)",
+                                       [(channel_id,) for channel_id in legacy])
+                self.active_channels.update(legacy)
+                os.replace(LEGACY_CHANNELS_FILE, LEGACY_CHANNELS_FILE + ".migrated")
+                print(f"Imported {len(legacy)} active channels from {LEGACY_CHANNELS_FILE} into {self.path}")
+
+    # Reads
+
+    def is_active(self, channel_id):
+        return channel_id in self.active_channels
+
+    def guild(self, guild):
+        """Returns the overrides of a guild (a discord.Guild or None for DMs)."""
+        if guild is None:
+            return GuildConfig()
+        return self.guilds.get(guild.id) or GuildConfig()
+
+    def get(self, key, default=None):
+        return self.bot_settings.get(key, default)
+
+    # Writes
+
+    def set_active(self, channel_id, guild_id, active):
+        if active:
+            self.active_channels.add(channel_id)
+        else:
+            self.active_channels.discard(channel_id)
+        self._mark(("active_channels", channel_id), guild_id if active else None)
+
+    def update_guild(self, guild_id, **changes):
+        """Changes some of a guild's overrides, e.g. update_guild(id, persona="assist")."""
+        guild = self.guilds.setdefault(guild_id, GuildConfig())
+        for name, value in changes.items():
+            setattr(guild, name, value)
+        if guild.is_default():
+            del self.guilds[guild_id]
+            guild = None
+        self._mark(("guild_settings", guild_id), guild)
+
+    def set(self, key, value):
+        self.bot_settings[key] = value
+        self._mark(("bot_settings", key), value)
+
+    def _mark(self, row, value):
+        self._dirty[row] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    def _write(self, rows):
+        with self._transaction() as connection:
+            for (table, key), value in rows.items():
+                if table == "active_channels":
+                    if value is None:
+                        connection.execute("DELETE FROM active_channels WHERE channel_id = ?", (key,))
+                    else:
+                        connection.execute("INSERT OR REPLACE INTO active_channels VALUES (?, ?)", (key, value))
+                elif table == "guild_settings":
+                    if value is None:
+                        connection.execute("DELETE FROM guild_settings WHERE guild_id = ?", (key,))
+                    else:
+                        connection.execute("INSERT OR REPLACE INTO guild_settings VALUES (?, ?, ?, ?)", (
+                            key, json.dumps(value.triggers) if value.triggers is not None else None,
+                            value.persona, value.rate_limit))
+                else:
+                    connection.execute("INSERT OR REPLACE INTO bot_settings VALUES (?, ?)", (key, json.dumps(value)))
+
+    async def flush(self):
+        """Writes every pending change in one transaction."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            rows, self._dirty = self._dirty, {}
+            # Guild overrides are mutable, write a snapshot of them
+            rows = {row: GuildConfig(value.triggers, value.persona, value.rate_limit)
+                    if isinstance(value, GuildConfig) else value for row, value in rows.items()}
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except sqlite3.Error as e:
+                print(f"\033[33mCould not save settings, retrying with the next change: {e!r}\033[0m")
+                self._dirty = {**rows, **self._dirty}
+
+    def close(self):
+        """Writes pending changes synchronously, for use after the event loop has stopped."""
+        if self._dirty:
+            rows, self._dirty = self._dirty, {}
+            self._write(rows)
+
+
+class UserRateLimiter:
+    """Sliding one-minute window of triggered messages per guild and user."""
+
+    def __init__(self):
+        self._hits = collections.defaultdict(collections.deque)
+        self.limited = 0
+
+    def allow(self, guild_id, user_id, per_minute):
+        if not per_minute:
+            return True
+        now = time.monotonic()
+        if len(self._hits) > 10000:
+            for key in [key for key, hits in self._hits.items() if not hits or hits[-1] <= now - RATE_LIMIT_WINDOW]:
+                del self._hits[key]
+        hits = self._hits[(guild_id, user_id)]
+        while hits and hits[0] <= now - RATE_LIMIT_WINDOW:
+            hits.popleft()
+        if len(hits) >= per_minute:
+            self.limited += 1
+            return False
+        hits.append(now)
+        return True
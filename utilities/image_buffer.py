@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import contextlib
+import io
+import os
+import tempfile
+
+from utilities.circuit_breaker import ProviderError
+from utilities.config_loader import config
+
+max_image_bytes = config.get('IMAGE_MAX_MB', 25) * 1024 * 1024
+spool_threshold = config.get('IMAGE_SPOOL_KB', 1024) * 1024
+download_budget_bytes = config.get('IMAGE_DOWNLOAD_BUDGET_MB', 64) * 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageTooLarge(ProviderError):
+    """Raised when a provider sends an image bigger than IMAGE_MAX_MB."""
+
+
+class ByteBudget:
+    """
+    A global cap on the memory held by downloaded images.
+
+    Each download reserves the memory its buffer may hold (at most the spool threshold,
+    since anything bigger goes to a temp file) before it starts, and waits while the
+    budget is exhausted. The reservation belongs to the returned ImageSpool and is given
+    back when the spool moves to disk or is closed, so the budget bounds the image bytes
+    held in memory at any one time, up to the upload. Reservations are all-or-nothing,
+    so downloads never hold part of the budget while waiting for more.
+    """
+
+    def __init__(self, limit=download_budget_bytes):
+        self.limit = limit
+        self.used = 0
+        self.waiting = 0
+        self._waiters = collections.deque()
+        self._loop = None
+
+    async def acquire(self, amount):
+        self._loop = asyncio.get_running_loop()
+        amount = min(amount, self.limit)
+        while self.used + amount > self.limit:
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            self.waiting += 1
+            try:
+                await waiter
+            finally:
+                self.waiting -= 1
+        self.used += amount
+        return amount
+
+    def release(self, amount):
+        """Gives back a reservation. Safe from any thread, the count only changes on the event loop's thread."""
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop or self._loop is None:
+            self._give_back(amount)
+            return
+        # Spools roll over in worker threads and may be closed by the garbage collector on any thread
+        try:
+            self._loop.call_soon_threadsafe(self._give_back, amount)
+        except RuntimeError:
+            # The loop is closed, nothing is waiting any more
+            self.used -= amount
+
+    def _give_back(self, amount):
+        self.used -= amount
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def status(self):
+        return f"{self.used // 1024}/{self.limit // 1024} KB of images held in memory, {self.waiting} downloads waiting"
+
+
+download_budget = ByteBudget()
+
+
+class ImageSpool(io.BufferedIOBase):
+    """
+    A downloaded image, kept in memory while it fits its budget reservation and in a temp file beyond that.
+
+    The reservation is released as soon as the bytes move to disk or the spool is closed.
+    Once on disk, `path` names the file so worker processes can open it themselves instead
+    of being sent its bytes; it is deleted on close. `content_type` is the one the provider sent.
+    """
+
+    def __init__(self, budget, reserved):
+        super().__init__()
+        self._budget = budget
+        self._reserved = reserved
+        self._file = io.BytesIO()
+        self.path = None
+        self.content_type = None
+
+    def _release(self):
+        if self._reserved:
+            self._budget.release(self._reserved)
+            self._reserved = 0
+
+    def rollover(self):
+        if self.path is not None:
+            return
+        fd, self.path = tempfile.mkstemp(prefix="image-", suffix=".spool")
+        file = open(fd, "w+b")
+        position = self._file.tell()
+        file.write(self._file.getbuffer())
+        file.seek(position)
+        self._file = file
+        self._release()
+
+    def source(self):
+        """What to hand a worker process: the temp file's path, or the bytes while the image is in memory."""
+        return self.path if self.path is not None else self._file.getvalue()
+
+    def write(self, data):
+        if self.path is None and self._file.tell() + len(data) > self._reserved:
+            self.rollover()
+        return self._file.write(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def read1(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._file.close()
+            if self.path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(self.path)
+        finally:
+            self._release()
+            super().close()
+
+
+async def spool_response(response, budget=download_budget, max_bytes=max_image_bytes):
+    """
+    Streams a response body into an ImageSpool that stays in memory up to IMAGE_SPOOL_KB and spills to a temp file above it.
+
+    Returns:
+        ImageSpool: The body, positioned at the start. It holds its share of the budget until it is closed,
+            so the caller closes it once the image is sent.
+
+    Raises:
+        ImageTooLarge: The body is bigger than max_bytes.
+    """
+    length = response.content_length
+    if length is not None and length > max_bytes:
+        raise ImageTooLarge(f"Image of {length} bytes is over the {max_bytes} byte limit")
+    reserved = await budget.acquire(min(length or spool_threshold, spool_threshold))
+    buffer = ImageSpool(budget, reserved)
+    buffer.content_type = response.content_type
+    try:
+        size = 0
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageTooLarge(f"Image is over the {max_bytes} byte limit")
+            # Writing to disk would block the event loop, and only happens past the threshold
+            if buffer.path is None and size <= reserved:
+                buffer.write(chunk)
+            else:
+                await asyncio.to_thread(buffer.write, chunk)
+        buffer.seek(0)
+        return buffer
+    except BaseException:
+        buffer.close()
+        raise
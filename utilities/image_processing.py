@@ -0,0 +1,206 @@
+import asyncio
+import io
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageDraw, ImageFont
+
+from utilities.config_loader import config
+
+image_format = config.get('IMAGE_FORMAT', 'webp').lower()
+image_quality = config.get('IMAGE_QUALITY', 80)
+image_target_kb = config.get('IMAGE_TARGET_KB', 0)
+image_grid = config.get('IMAGE_GRID', True)
+image_grid_cell = config.get('IMAGE_GRID_CELL', 384)
+image_workers = config.get('IMAGE_WORKERS', 2)
+
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg", "png": "png"}
+# Extensions of images passed through unprocessed, by content type and by their first bytes
+CONTENT_TYPES = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp", "image/gif": "gif"}
+SIGNATURES = ((b"\x89PNG", "png"), (b"\xff\xd8\xff", "jpg"), (b"GIF8", "gif"), (b"RIFF", "webp"))
+MIN_QUALITY = 30
+
+_executor = None
+
+
+def _save(image, fmt, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt.upper(), quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _encode(image, fmt, quality, target_bytes):
+    """Encodes the image, lowering quality and then size until it fits under target_bytes (0 for no limit)."""
+    if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    data = _save(image, fmt, quality)
+    if not target_bytes or fmt == "png":
+        return data
+    candidate = data
+    while len(data) > target_bytes:
+        # A configured quality below MIN_QUALITY is searched from itself, so the loop always runs
+        low, high = min(MIN_QUALITY, quality), quality
+        best = None
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = _save(image, fmt, middle)
+            if len(candidate) <= target_bytes:
+                best, low = candidate, middle + 1
+            else:
+                high = middle - 1
+        if best is not None:
+            return best
+        if min(image.size) < 64:
+            return candidate
+        image = image.resize((int(image.width * 0.85), int(image.height * 0.85)), Image.LANCZOS)
+        data = _save(image, fmt, quality)
+    return data
+
+
+def _open(source):
+    # A path when the image was spooled to disk, read here in the worker rather than shipped over
+    return Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def _recompress(source, fmt, quality, target_bytes):
+    with _open(source) as image:
+        image.load()
+        return _encode(image, fmt, quality, target_bytes)
+
+
+def _compose_grid(images, cell, fmt, quality, target_bytes):
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    sheet = Image.new("RGB", (columns * cell, rows * cell), (20, 20, 20))
+    draw = ImageDraw.Draw(sheet)
+    try:
+        font = ImageFont.load_default(size=max(12, cell // 16))
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    for index, source in enumerate(images):
+        with _open(source) as image:
+            image = image.convert("RGB")
+            image.thumbnail((cell, cell))
+            x = (index % columns) * cell + (cell - image.width) // 2
+            y = (index // columns) * cell + (cell - image.height) // 2
+            sheet.paste(image, (x, y))
+        label = str(index + 1)
+        left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+        corner = ((index % columns) * cell + 6, (index // columns) * cell + 6)
+        draw.rectangle((corner[0], corner[1], corner[0] + right - left + 8, corner[1] + bottom - top + 8), fill=(0, 0, 0))
+        draw.text((corner[0] + 4 - left, corner[1] + 4 - top), label, font=font, fill=(255, 255, 255))
+    return _encode(sheet, fmt, quality, target_bytes)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # The bot already runs threads by the time the pool starts, forking it could copy a held lock
+        _executor = ProcessPoolExecutor(max_workers=image_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+
+
+async def recompress(source, fmt=image_format, quality=image_quality, target_kb=image_target_kb):
+    """
+    Re-encodes an image in a worker process.
+
+    Args:
+        source (bytes or str): The image's bytes, or the path of a file holding it.
+
+    Returns:
+        tuple: The encoded bytes and the file extension to upload them with.
+    """
+    return await _run(_recompress, source, fmt, quality, target_kb * 1024), EXTENSIONS[fmt]
+
+
+async def compose_grid(images, cell=image_grid_cell, fmt=image_format, quality=image_quality,
+                       target_kb=image_target_kb):
+    """
+    Composes several images into one contact sheet with the index of each cell in its corner, in a worker process.
+
+    Args:
+        images (list): The images' bytes or the paths of files holding them.
+
+    Returns:
+        tuple: The encoded bytes and the file extension to upload them with.
+    """
+    return await _run(_compose_grid, images, cell, fmt, quality, target_kb * 1024), EXTENSIONS[fmt]
+
+
+def _original_extension(file):
+    """
+    The extension an unprocessed image is uploaded with, from its content type or else its first bytes.
+    Leaves the file at its start, ready for the upload.
+    """
+    file.seek(0)
+    extension = CONTENT_TYPES.get(getattr(file, "content_type", None))
+    if extension is None:
+        header = file.read(16)
+        file.seek(0)
+        extension = next((extension for signature, extension in SIGNATURES if header.startswith(signature)), "png")
+    return extension
+
+
+def _sources(files):
+    sources = []
+    for file in files:
+        if hasattr(file, "source"):
+            sources.append(file.source())
+        else:
+            file.seek(0)
+            sources.append(file.read())
+    return sources
+
+
+async def prepare_uploads(images, name="image", grid=image_grid):
+    """
+    Post-processes generated images for upload according to the IMAGE_* settings.
+
+    Several images become one contact sheet when IMAGE_GRID is on; otherwise each one is
+    recompressed. When nothing needs re-encoding the files are passed through without
+    being read into memory, and images spooled to disk are read by the worker process
+    from their file. If processing fails, the originals are returned unchanged.
+
+    Args:
+        images (list): ImageSpools (or other binary file objects) holding the generated images,
+            as returned by the image providers. They are closed here unless they are passed through.
+
+    Returns:
+        list: (file object, filename) pairs ready for discord.File. The caller closes them.
+    """
+    combine = grid and len(images) > 1
+    if not combine and image_format == "png" and not image_target_kb:
+        results = [(image, _original_extension(image)) for image in images]
+    else:
+        try:
+            # Spooled images are opened by path in the worker, only small in-memory ones are sent as bytes
+            sources = await asyncio.to_thread(_sources, images)
+            if combine:
+                data, extension = await compose_grid(sources)
+                for image in images:
+                    image.close()
+                return [(io.BytesIO(data), f"{name}_grid.{extension}")]
+            results = await asyncio.gather(*(recompress(source) for source in sources))
+            results = [(io.BytesIO(data), extension) for data, extension in results]
+            for image in images:
+                image.close()
+        except (OSError, ValueError, BrokenProcessPool, Image.DecompressionBombError) as e:
+            print(f"Image post-processing failed, sending the originals: {e!r}")
+            results = [(image, _original_extension(image)) for image in images]
+    if len(results) == 1:
+        return [(results[0][0], f"{name}.{results[0][1]}")]
+    return [(file, f"{name}_{index + 1}.{extension}") for index, (file, extension) in enumerate(results)]
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,159 @@
+import asyncio
+import contextlib
+import os
+import time
+
+from utilities import json_codec
+from utilities.config_loader import config
+
+journal_file = config.get('JOB_JOURNAL_FILE', 'image_jobs.jsonl')
+journal_max_age = config.get('JOB_JOURNAL_MAX_AGE', 3600)
+# Finished jobs the journal may hold before it is rewritten with only the unfinished ones
+COMPACT_AFTER = 200
+# Discord accepts interaction follow-ups for 15 minutes, later results go to the channel
+INTERACTION_LIFETIME = 14 * 60
+
+
+class JournalEntry:
+    """One image generation, written to the journal once its provider job exists."""
+
+    def __init__(self, journal, provider, target):
+        self.journal = journal
+        self.provider = provider
+        self.target = target
+        self.job_id = None
+        self.created = time.time()
+
+    @classmethod
+    def from_record(cls, journal, record):
+        entry = cls(journal, record["provider"], record["target"])
+        entry.job_id = record["job"]
+        entry.created = record["created"]
+        return entry
+
+    @property
+    def age(self):
+        return time.time() - self.created
+
+    @property
+    def interaction_alive(self):
+        return self.target.get("interaction") is not None and self.age < INTERACTION_LIFETIME
+
+    async def queued(self, job_id):
+        self.job_id = job_id
+        await self.journal.append({"job": job_id, "provider": self.provider, "target": self.target,
+                                   "created": self.created, "status": "queued"})
+
+    async def finish(self, status):
+        """Marks the job done, e.g. "delivered" or "failed". Does nothing if it was never queued."""
+        if self.job_id is not None:
+            await self.journal.append({"job": self.job_id, "status": status})
+
+
+class JobJournal:
+    """
+    Append-only journal of queued image jobs, so a restart does not lose them.
+
+    A line is appended when a provider accepts a job and another when its image has
+    been delivered or the job failed. Jobs without a final line were interrupted by a
+    restart: load() returns them so they can be polled again and delivered, and the
+    file is rewritten with only those jobs. Jobs older than JOB_JOURNAL_MAX_AGE are
+    dropped, the provider no longer keeps their images by then.
+
+    Slash command jobs are journaled with their interaction token, in plain text, so
+    the image can still answer the command. A token lets anyone holding it post as the
+    bot in that channel for 15 minutes, so the journal is created readable by the bot's
+    user only (mode 0600, where the platform supports it).
+    """
+
+    def __init__(self, path=journal_file, max_age=journal_max_age):
+        self.path = path
+        self.max_age = max_age
+        self.pending = {}
+        self.finished = 0
+        self.resumed = 0
+        self._lock = asyncio.Lock()
+
+    def track(self, provider, target):
+        """
+        Starts an entry for a generation that is about to be queued.
+
+        Args:
+            provider (str): The provider the job is queued with, e.g. "prodia".
+            target (dict): Where the image goes: channel_id, user_id, prompt and optionally the
+                interaction's application_id and token.
+
+        Returns:
+            JournalEntry: Pass its queued() to the generator and call finish() once delivered.
+        """
+        return JournalEntry(self, provider, target)
+
+    def _open(self, path, flags):
+        # Created private to the bot's user, it holds interaction tokens
+        return open(os.open(path, os.O_WRONLY | os.O_CREAT | flags, 0o600), "w", encoding="utf-8")
+
+    def _append_line(self, line):
+        with self._open(self.path, os.O_APPEND) as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self, records):
+        # Written aside and renamed, so a crash half-way leaves the old journal intact
+        temporary = f"{self.path}.tmp"
+        # A copy left by an earlier crash would keep its permissions, start afresh
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary)
+        with self._open(temporary, os.O_TRUNC) as f:
+            f.writelines(json_codec.dumps(record) + "\n" for record in records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    async def append(self, record):
+        async with self._lock:
+            if record["status"] == "queued":
+                self.pending[record["job"]] = record
+            elif self.pending.pop(record["job"], None) is not None:
+                self.finished += 1
+            await asyncio.to_thread(self._append_line, json_codec.dumps(record) + "\n")
+            if self.finished >= COMPACT_AFTER:
+                await asyncio.to_thread(self._rewrite, list(self.pending.values()))
+                self.finished = 0
+
+    async def load(self):
+        """
+        Reads the journal left by the previous run and compacts it, in a worker thread.
+        Jobs queued meanwhile are appended once it is done.
+
+        Returns:
+            list: JournalEntry objects of the unfinished jobs that are recent enough to resume.
+        """
+        async with self._lock:
+            return await asyncio.to_thread(self._load)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return []
+        pending = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json_codec.loads(line)
+                except ValueError:
+                    # The last line may be cut short by a crash while it was written
+                    continue
+                if record["status"] == "queued":
+                    pending[record["job"]] = record
+                else:
+                    pending.pop(record["job"], None)
+        now = time.time()
+        self.pending = {job: record for job, record in pending.items() if now - record["created"] < self.max_age}
+        expired = len(pending) - len(self.pending)
+        if expired:
+            print(f"\033[33mDropping {expired} image jobs from {self.path} that are too old to resume\033[0m")
+        self._rewrite(list(self.pending.values()))
+        return [JournalEntry.from_record(self, record) for record in self.pending.values()]
+
+    def status(self):
+        return f"{len(self.pending)} in flight | {self.resumed} resumed after a restart"
@@ -0,0 +1,38 @@
+"""
+JSON encoding and decoding for provider traffic.
+
+Uses orjson when it is installed and JSON_CODEC allows it, the standard library
+otherwise. Both produce compact output and leave non-ASCII text unescaped. Pass
+`loads` to aiohttp's response.json() and `dumps` as a session's json_serialize so
+provider clients do not fall back to the stdlib parser; `dumpb` returns UTF-8 bytes
+for bodies that are assembled by hand.
+"""
+import json
+
+from utilities.config_loader import config
+
+json_codec = config.get('JSON_CODEC', 'auto')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if json_codec == 'orjson' and orjson is None:
+    print("\033[33mJSON_CODEC is orjson but it is not installed, using the standard library\033[0m")
+
+if orjson is not None and json_codec in ('auto', 'orjson'):
+    backend = "orjson"
+    loads = orjson.loads
+    dumpb = orjson.dumps
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    backend = "json"
+    loads = json.loads
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    dumps = _encoder.encode
+
+    def dumpb(obj):
+        return _encoder.encode(obj).encode()
@@ -0,0 +1,257 @@
+import asyncio
+import collections
+import gc
+import io
+import os
+import random
+import sys
+import sysconfig
+import time
+import tracemalloc
+
+import aiohttp
+
+from utilities.config_loader import config
+from utilities.image_buffer import ImageSpool
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+memdiag_interval = config.get('MEMDIAG_INTERVAL', 0)
+memdiag_tracemalloc = config.get('MEMDIAG_TRACEMALLOC', False)
+# Containers with more entries than this are sized from a random sample of them
+SAMPLE_SIZE = 500
+TOP_ALLOCATIONS = 10
+# Objects inspected between two yields to the event loop while scanning the heap
+SCAN_SLICE = 20000
+STDLIB = sysconfig.get_paths()["stdlib"]
+CONTAINERS = (list, tuple, set, frozenset, collections.deque)
+# Allocations made by the diagnostics themselves are left out of the diffs
+TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} GB"
+
+
+def _site(stat):
+    frame = stat.traceback[0]
+    filename = frame.filename
+    if "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith(STDLIB):
+        filename = os.path.relpath(filename, STDLIB)
+    elif filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    return f"{filename}:{frame.lineno}"
+
+
+def deep_size(obj, seen, sample=SAMPLE_SIZE):
+    """
+    Estimates the bytes held by an object and everything it refers to.
+
+    Follows builtin containers and the bot's own objects (classes from utilities), other
+    objects count with their own size only. Objects in `seen` are skipped, so memory
+    shared between structures is only counted once.
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, CONTAINERS):
+        items = obj
+    elif type(obj).__module__.startswith("utilities.") and hasattr(obj, "__dict__"):
+        return size + deep_size(vars(obj), seen, sample)
+    else:
+        return size
+    count = len(items)
+    if count > sample:
+        items = random.sample(list(items), sample)
+    children = 0
+    for item in items:
+        if isinstance(obj, dict):
+            children += deep_size(item[0], seen, sample) + deep_size(item[1], seen, sample)
+        else:
+            children += deep_size(item, seen, sample)
+    return size + (children * count // len(items) if count else 0)
+
+
+def rss_bytes():
+    """Returns the current and peak resident set size, None where the platform does not tell."""
+    current = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024
+    return current, peak
+
+
+async def scan_objects(slice_size=SCAN_SLICE):
+    """
+    Counts live aiohttp sessions and connectors and in-memory image buffers among all gc-tracked objects.
+
+    Runs on the event loop, the only thread that may read their state, and yields to it
+    every slice_size objects so a big heap does not hold up replies.
+    """
+    counts = collections.Counter()
+    objects = gc.get_objects()
+    counts["objects"] = len(objects)
+    for index, obj in enumerate(objects):
+        if index % slice_size == 0:
+            await asyncio.sleep(0)
+        if isinstance(obj, aiohttp.ClientSession):
+            counts["sessions open" if not obj.closed else "sessions closed"] += 1
+        elif isinstance(obj, aiohttp.BaseConnector):
+            counts["connectors open" if not obj.closed else "connectors closed"] += 1
+        elif isinstance(obj, io.BytesIO):
+            counts["BytesIO"] += 1
+            # getsizeof includes the buffer and, unlike getbuffer(), does not pin it
+            counts["BytesIO bytes"] += sys.getsizeof(obj)
+        elif isinstance(obj, ImageSpool):
+            counts["spooled files" if not obj.closed else "spooled files closed"] += 1
+    return counts
+
+
+class MemoryDiagnostics:
+    """
+    Reports where the bot's memory goes, without a restart.
+
+    Each report holds the RSS, the entries and estimated deep size of every tracked
+    structure (message history, caches, pools...), discord.py's caches, the live aiohttp
+    sessions and connectors and image buffers, and, while tracemalloc runs, the source
+    lines whose allocations grew most since the previous report. /memdiag sends one, and
+    with MEMDIAG_INTERVAL set one is printed every that many minutes.
+    """
+
+    def __init__(self, bot, interval=memdiag_interval, trace=memdiag_tracemalloc):
+        self.bot = bot
+        self.interval = interval
+        self.trace = trace
+        self.structures = {}
+        self._snapshot = None
+        self._snapshot_time = None
+        self._task = None
+
+    def track(self, name, get):
+        """
+        Adds a structure to the reports.
+
+        Args:
+            name (str): Label of the structure in the report.
+            get (callable): Returns the structure, looked up on every report since some are replaced over time.
+        """
+        self.structures[name] = get
+
+    def _structure_rows(self):
+        seen = set()
+        rows = []
+        for name, get in self.structures.items():
+            structure = get()
+            try:
+                entries = len(structure)
+            except TypeError:
+                entries = None
+            rows.append((name, entries, deep_size(structure, seen)))
+        return rows
+
+    def _discord_caches(self):
+        bot = self.bot
+        return {
+            "guilds": len(bot.guilds),
+            "users": len(bot.users),
+            "members": sum(len(guild.members) for guild in bot.guilds),
+            "channels": sum(len(guild.channels) for guild in bot.guilds),
+            "messages": len(bot.cached_messages),
+            "emojis": len(bot.emojis),
+            "stickers": len(bot.stickers),
+            "dm channels": len(bot.private_channels),
+        }
+
+    def start_tracing(self):
+        """Starts tracemalloc if it is not running, the next report diffs against this point."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._snapshot = None
+
+    def _allocation_diff(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+        previous, previous_time = self._snapshot, self._snapshot_time
+        self._snapshot, self._snapshot_time = snapshot, time.monotonic()
+        if previous is None:
+            return None, snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        return time.monotonic() - previous_time, snapshot.compare_to(previous, "lineno")[:TOP_ALLOCATIONS]
+
+    async def report(self):
+        """
+        Builds a memory report.
+
+        Returns:
+            str: The report as plain text.
+        """
+        current, peak = rss_bytes()
+        lines = [f"RSS {format_bytes(current) if current is not None else 'unknown'}"
+                 f" | peak {format_bytes(peak) if peak is not None else 'unknown'}", ""]
+
+        lines.append(f"{'Bot state':<28}{'entries':>10}{'size':>12}")
+        for name, entries, size in self._structure_rows():
+            lines.append(f"  {name:<26}{entries if entries is not None else '-':>10}{format_bytes(size):>12}")
+        lines.append("  (sizes are estimates; memory shared with a row above is counted there)")
+
+        if self.bot.is_ready():
+            lines += ["", "discord.py caches"]
+            lines.append("  " + " | ".join(f"{name} {count}" for name, count in self._discord_caches().items()))
+
+        counts = await scan_objects()
+        lines += ["", f"Objects tracked by gc: {counts['objects']}",
+                  f"  aiohttp sessions: {counts['sessions open']} open, {counts['sessions closed']} closed but not freed",
+                  f"  aiohttp connectors: {counts['connectors open']} open, {counts['connectors closed']} closed but not freed",
+                  f"  BytesIO buffers: {counts['BytesIO']} holding {format_bytes(counts['BytesIO bytes'])}",
+                  f"  spooled image files: {counts['spooled files']} open, {counts['spooled files closed']} closed"]
+
+        if tracemalloc.is_tracing():
+            elapsed, stats = await asyncio.to_thread(self._allocation_diff)
+            traced, _ = tracemalloc.get_traced_memory()
+            lines.append("")
+            if elapsed is None:
+                lines.append(f"tracemalloc: {format_bytes(traced)} traced, largest allocation sites "
+                             "(the next report shows what grew):")
+                lines += [f"  {_site(stat)}  {format_bytes(stat.size)} in {stat.count} blocks" for stat in stats]
+            else:
+                lines.append(f"tracemalloc: {format_bytes(traced)} traced, top growth over the last {elapsed / 60:.0f} min:")
+                lines += [f"  {_site(stat)}  {'+' if stat.size_diff >= 0 else '-'}{format_bytes(abs(stat.size_diff))} "
+                          f"({stat.count_diff:+} blocks)" for stat in stats]
+        else:
+            lines += ["", "tracemalloc is off, /memdiag trace:True starts it"]
+        return "\n".join(lines)
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval * 60)
+            try:
+                print(f"Memory report:\n{await self.report()}")
+            except Exception as e:
+                print(f"\033[33mCould not build the memory report: {e!r}\033[0m")
+
+    def start(self):
+        if self.trace:
+            self.start_tracing()
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._report_periodically())
@@ -0,0 +1,165 @@
+import asyncio
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+import traceback
+
+from utilities.config_loader import config
+
+slow_handler_threshold = config.get('SLOW_HANDLER_THRESHOLD_MS', 5000) / 1000
+loop_block_threshold = config.get('LOOP_BLOCK_THRESHOLD_MS', 250) / 1000
+profiler_interval = config.get('PROFILER_INTERVAL_MS', 5) / 1000
+profiler_max_seconds = config.get('PROFILER_MAX_SECONDS', 60)
+
+_profile_lock = asyncio.Lock()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """Turns a frame into a root-first, semicolon separated stack (flamegraph collapsed format)."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class LoopSampler:
+    """Samples the stack of one thread from a helper thread at a fixed interval."""
+
+    def __init__(self, thread_id, interval=profiler_interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loop-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+async def profile_loop(seconds):
+    """
+    Samples the running event loop for the given duration.
+
+    Args:
+        seconds (float): How long to profile, capped by PROFILER_MAX_SECONDS.
+
+    Returns:
+        tuple: The number of samples and the collapsed stacks as text.
+    """
+    seconds = max(1, min(seconds, profiler_max_seconds))
+    async with _profile_lock:
+        sampler = LoopSampler(threading.get_ident())
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+    return sum(sampler.samples.values()), sampler.collapsed()
+
+
+class LoopWatchdog:
+    """Prints the loop thread's stack whenever the event loop stops ticking for too long."""
+
+    def __init__(self, threshold=loop_block_threshold):
+        self.threshold = threshold
+        self.thread_id = None
+        self._last_beat = time.monotonic()
+        self._stop = threading.Event()
+        self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.threshold / 4):
+            lag = time.monotonic() - self._last_beat
+            if lag < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            frame = sys._current_frames().get(self.thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>\n"
+            print(f"\033[33mEvent loop blocked for {lag * 1000:.0f} ms, loop thread is at:\033[0m\n{stack}")
+
+    def start(self):
+        if self.threshold <= 0 or self._task is not None:
+            return
+        self.thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+
+def _report_slow(label, task, started):
+    elapsed = (time.monotonic() - started) * 1000
+    print(f"\033[33m{label} still running after {elapsed:.0f} ms, currently awaiting:\033[0m")
+    task.print_stack(file=sys.stdout)
+
+
+class SlowCallTracer:
+    """Arms a timer that prints the task's await stack if a handler overruns the threshold."""
+
+    def __init__(self, label, threshold=slow_handler_threshold):
+        self.label = label
+        self.threshold = threshold
+        self._handle = None
+        self._started = None
+
+    def start(self):
+        self._started = time.monotonic()
+        task = asyncio.current_task()
+        if self.threshold > 0 and task is not None:
+            self._handle = asyncio.get_running_loop().call_later(
+                self.threshold, _report_slow, self.label, task, self._started)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+        elapsed = time.monotonic() - self._started
+        if self.threshold > 0 and elapsed >= self.threshold:
+            print(f"\033[33m{self.label} took {elapsed * 1000:.0f} ms\033[0m")
+
+
+def trace_slow(func):
+    """Decorator for event handlers that logs them when their wall time passes the threshold."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        tracer = SlowCallTracer(func.__name__)
+        tracer.start()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            tracer.stop()
+    return wrapper
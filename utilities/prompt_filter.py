@@ -0,0 +1,91 @@
+import re
+import unicodedata
+
+from utilities.config_loader import config
+
+blacklisted_words = config.get('BLACKLIST_WORDS') or []
+nsfw_classifier = config.get('AI_NSFW_CONTENT_FILTER', False)
+nsfw_threshold = config.get('NSFW_SCORE_THRESHOLD', 1.0)
+
+# Characters commonly swapped in to dodge word filters (leetspeak and Cyrillic or Greek
+# look-alikes, after casefolding), mapped back to latin letters
+LEET = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "@": "a", "$": "s",
+                      "!": "i", "|": "l", "+": "t", "€": "e", "¢": "c",
+                      "а": "a", "в": "b", "е": "e", "к": "k", "м": "m", "н": "h", "о": "o", "р": "p", "с": "c",
+                      "т": "t", "у": "y", "х": "x", "і": "i", "ј": "j", "ѕ": "s",
+                      "α": "a", "ε": "e", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p", "τ": "t", "χ": "x"})
+ZERO_WIDTH = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff\u00ad"))
+SEPARATORS = r"[\W_]+"
+SUFFIXES = r"(?:s|es|y|ies|ing|ed)?"
+
+# Weights of the local classifier: a prompt is rejected when the weights of its words
+# add up to NSFW_SCORE_THRESHOLD. Strong terms reject on their own, weaker ones only
+# together (e.g. "nude" or "bikini" alone is not enough, "sexy nude" is). Only suggestive
+# terms have a weight, everyday words like "woman" or "bed" never count towards it.
+NSFW_WEIGHTS = {
+    "porn": 1.0, "hentai": 1.0, "nsfw": 1.0, "nude": 0.6, "nudes": 1.0, "naked": 0.6, "topless": 0.8,
+    "bottomless": 0.8, "lingerie": 0.5, "underwear": 0.3, "bikini": 0.3, "erotic": 0.8, "explicit": 0.5,
+    "sexy": 0.4, "sensual": 0.4, "seductive": 0.4, "sex": 0.8, "sexual": 0.7, "nipple": 0.9, "nipples": 0.9,
+    "breast": 0.5, "breasts": 0.5, "boobs": 0.8, "butt": 0.3, "genitals": 1.0, "penis": 1.0, "vagina": 1.0,
+    "orgasm": 1.0, "fetish": 0.7, "bdsm": 1.0, "bondage": 0.8, "xxx": 1.0, "onlyfans": 0.8, "strip": 0.3,
+    "stripper": 0.7, "undressed": 0.7, "undressing": 0.7, "loli": 1.0, "shota": 1.0, "gore": 0.8,
+}
+
+
+def normalize(text):
+    """Casefolds, strips accents and zero-width characters and undoes leetspeak, in a few C-level passes."""
+    text = unicodedata.normalize("NFKD", text.casefold().translate(ZERO_WIDTH))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return text.translate(LEET)
+
+
+def _word_pattern(word):
+    # Every letter may repeat ("s3xxx"), and a word matches when written together or with
+    # every one of its letters separated ("s.e.x", "s e x"), but never inside another word.
+    # Partly separated forms are left alone, they are mostly ordinary text ("Tom's ex")
+    words = normalize(word).split()
+    together = SEPARATORS.join("".join(re.escape(letter) + "+" for letter in part) for part in words)
+    spaced = SEPARATORS.join(re.escape(letter) + "+" for letter in "".join(words))
+    return r"(?<![a-z])(?:" + together + "|" + spaced + ")" + SUFFIXES + r"(?![a-z])"
+
+
+def compile_blocklist(words):
+    """Compiles the words into one regex that finds any of them in a single pass over the normalized prompt."""
+    patterns = sorted({_word_pattern(word) for word in words if word.strip()}, key=len, reverse=True)
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+class PromptFilter:
+    """
+    Screens image prompts before any job is queued with a provider.
+
+    The BLACKLIST_WORDS are always applied. With AI_NSFW_CONTENT_FILTER on, a small local
+    classifier scores the prompt's words as well, so combinations of harmless-looking
+    words are caught too. Both run on the same normalized text, in microseconds.
+    """
+
+    def __init__(self, words=blacklisted_words, classifier=nsfw_classifier, threshold=nsfw_threshold):
+        self.blocklist = compile_blocklist(words)
+        self.classifier = classifier
+        self.threshold = threshold
+        self.rejected = 0
+
+    def score(self, normalized):
+        return sum(NSFW_WEIGHTS.get(word, 0.0) for word in set(re.findall(r"[a-z]+", normalized)))
+
+    def check(self, prompt):
+        """
+        Returns why the prompt is not allowed, or None when it may be sent to a provider.
+        """
+        normalized = normalize(prompt)
+        if self.blocklist is not None:
+            match = self.blocklist.search(normalized)
+            if match:
+                self.rejected += 1
+                return f"blocked word ({match.group(0)!r})"
+        if self.classifier and self.score(normalized) >= self.threshold:
+            self.rejected += 1
+            return "flagged by the NSFW filter"
+        return None
@@ -0,0 +1,122 @@
+import collections
+
+from utilities import json_codec
+
+# Conversations whose encoded turns are kept, least recently used ones are dropped
+MAX_CONVERSATIONS = 1000
+
+
+class SerializedMessages(list):
+    """A messages list that also carries its UTF-8 JSON encoding, so chat clients do not encode it again."""
+
+    def __init__(self, messages, json):
+        super().__init__(messages)
+        self.json = json
+
+
+def encode_messages(messages):
+    """Returns the JSON of a messages list as UTF-8 bytes, reusing the encoding carried by SerializedMessages."""
+    encoded = getattr(messages, "json", None)
+    return encoded if encoded is not None else json_codec.dumpb(messages)
+
+
+class _EncodedHistory:
+    """The encoded turns of one conversation, joined with commas in one growing buffer."""
+
+    def __init__(self):
+        self.turns = []
+        self.offsets = []
+        self.positions = {}
+        self.buffer = bytearray()
+
+    def append(self, turn, fragment):
+        if self.buffer:
+            self.buffer += b","
+        self.positions[id(turn)] = len(self.turns)
+        self.turns.append(turn)
+        self.offsets.append(len(self.buffer))
+        self.buffer += fragment
+
+    def drop_front(self, count):
+        start = self.offsets[count]
+        del self.buffer[:start]
+        self.turns = self.turns[count:]
+        self.offsets = [offset - start for offset in self.offsets[count:]]
+        self.positions = {id(turn): position for position, turn in enumerate(self.turns)}
+
+
+class PromptSerializer:
+    """
+    Encodes chat requests incrementally.
+
+    Conversation histories only grow at the end and lose turns at the front (MAX_HISTORY
+    trimming and compaction), so the encoded history of each conversation is kept in one
+    buffer. A request then costs encoding the new turns and the small system messages,
+    plus a single copy of the buffer, instead of encoding every turn again. The cached
+    run is matched by identity at both of its ends, and the cache keeps references to the
+    turns so their ids cannot be reused meanwhile. Any other change starts over.
+    """
+
+    def __init__(self, max_conversations=MAX_CONVERSATIONS):
+        self.max_conversations = max_conversations
+        self._histories = collections.OrderedDict()
+        self._static = {}
+        self.encoded = 0
+        self.reused = 0
+
+    def _encode_static(self, message):
+        # System prompts are few and long, keep their encoding by content
+        key = (message.get("name"), message["content"])
+        fragment = self._static.get(key)
+        if fragment is None:
+            if len(self._static) > 64:
+                self._static.clear()
+            fragment = self._static[key] = json_codec.dumpb(message)
+        return fragment
+
+    def _encode_history(self, conversation, history):
+        """Returns the conversation's buffer, extended with the new turns, and the offset `history` starts at."""
+        cached = self._histories.pop(conversation, None) if conversation is not None else None
+        first = cached.positions.get(id(history[0])) if cached is not None else None
+        kept = len(cached.turns) - first if first is not None else 0
+        if (first is None or cached.turns[first] is not history[0] or len(history) < kept
+                or history[kept - 1] is not cached.turns[-1]):
+            cached, first, kept = _EncodedHistory(), 0, 0
+        elif first * 2 >= len(cached.turns):
+            # Trimmed turns are only cut off once they make up half the buffer, so this stays cheap per request
+            cached.drop_front(first)
+            first = 0
+        for turn in history[kept:]:
+            cached.append(turn, json_codec.dumpb(turn))
+        self.encoded += len(history) - kept
+        self.reused += kept
+        if conversation is not None:
+            self._histories[conversation] = cached
+            while len(self._histories) > self.max_conversations:
+                self._histories.popitem(last=False)
+        return cached.buffer, cached.offsets[first]
+
+    def serialize(self, conversation, head, history, tail):
+        """
+        Builds the messages for one request.
+
+        Args:
+            conversation: Key of the conversation the history belongs to, None to skip caching.
+            head (list): System messages before the history; the first one (the instructions) is cached by content.
+            history (list): The conversation turns, encoded once each.
+            tail (list): Messages after the history, encoded on every call.
+
+        Returns:
+            SerializedMessages: The messages, with their UTF-8 JSON in .json.
+        """
+        parts = [self._encode_static(head[0])] if head else []
+        parts += [json_codec.dumpb(message) for message in head[1:]]
+        if history:
+            buffer, start = self._encode_history(conversation, history)
+            # A view, so the history is copied once, straight into the request body
+            parts.append(memoryview(buffer)[start:])
+        parts += [json_codec.dumpb(message) for message in tail]
+        return SerializedMessages([*head, *history, *tail], b"[" + b",".join(parts) + b"]")
+
+    def forget(self, conversation):
+        self._histories.pop(conversation, None)
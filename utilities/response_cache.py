@@ -0,0 +1,90 @@
+import collections
+import hashlib
+import json
+import re
+import time
+
+from utilities.chat_providers import PartialReply
+from utilities.config_loader import config
+
+cache_enabled = config.get('RESPONSE_CACHE', False)
+cache_ttl = config.get('RESPONSE_CACHE_TTL', 3600)
+cache_max_entries = config.get('RESPONSE_CACHE_MAX_ENTRIES', 512)
+cache_history_tail = config.get('RESPONSE_CACHE_HISTORY_TAIL', 2)
+
+
+def normalize_prompt(prompt):
+    """Lowercases, collapses whitespace and drops surrounding punctuation, so trivial variations share an entry."""
+    return re.sub(r"\s+", " ", prompt.casefold()).strip(" \t\n?!.,")
+
+
+class ResponseCache:
+    """
+    Exact-match LRU cache of replies, keyed by persona, normalized prompt, the conversation
+    summary and the tail of the history.
+
+    Replies that depend on search results or attachments are never cached, nor are the ones
+    that would have had search results had the search not failed or been skipped for time.
+    Replies whose stream broke off are not stored either.
+    """
+
+    def __init__(self, enabled=cache_enabled, ttl=cache_ttl, max_entries=cache_max_entries,
+                 history_tail=cache_history_tail):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.history_tail = history_tail
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def key_for(self, persona, prompt, history, summary=None, context=False):
+        """
+        Returns the cache key for a prompt, or None when the reply must not be cached.
+
+        Args:
+            history (list): The conversation before the prompt.
+            summary (str): Summary of the turns compacted out of the history.
+            context (bool): The reply draws on search results or attachments, or was meant to.
+        """
+        if not self.enabled:
+            return None
+        if context:
+            self.bypassed += 1
+            return None
+        tail = [(turn["role"], turn["content"]) for turn in history[-self.history_tail:]] if self.history_tail else []
+        history_hash = hashlib.sha256(json.dumps([summary, tail]).encode()).hexdigest()
+        return (persona, normalize_prompt(prompt), history_hash)
+
+    def get(self, key):
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, response):
+        # A reply cut short by a broken stream would be served whole for the TTL
+        if key is None or response is None or isinstance(response, PartialReply):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def status(self):
+        if not self.enabled:
+            return "disabled"
+        return (f"{len(self._entries)}/{self.max_entries} entries, {self.hit_rate():.0%} hit rate "
+                f"({self.hits} hits, {self.misses} misses, {self.bypassed} bypassed)")
@@ -2,6 +2,7 @@ import re
 import random
 import aiohttp
 from langdetect import detect
+from utilities import json_codec
 
 async def replace_with_image_url(response):
     match = re.search(r'<draw:(.*?)>', response)
@@ -25,7 +26,7 @@ async def get_random_image_url(query):
     async with aiohttp.ClientSession() as session:
         async with session.get(url) as response:
             if response.status == 200:
-                json_data = await response.json()
+                json_data = await response.json(loads=json_codec.loads)
                 images_results = json_data.get("images_results", [])
                 if images_results:
                     original_urls = [result["original"] for result in images_results]
@@ -61,7 +62,7 @@ async def translate_to_en(text):
     API_URL = "https://api.pawan.krd/gtranslate"
     async with aiohttp.ClientSession() as session:
         async with session.get(API_URL, params={"text": text,"from": detected_lang,"to": "en",}) as response:
-            data = await response.json()
+            data = await response.json(loads=json_codec.loads)
             translation = data.get("translated")
             return translation
 
@@ -83,10 +84,10 @@ async def get_random_prompt(prompt):
         'model': 'lexica-aperture-v2'
     }
 
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(json_serialize=json_codec.dumps) as session:
         async with session.post(url, headers=headers, json=data) as response:
             if response.status == 200:
-                response_json = await response.json()
+                response_json = await response.json(loads=json_codec.loads)
                 prompts = response_json['prompts']
                 random_prompt = random.choice(prompts)
                 return random_prompt['prompt']
@@ -0,0 +1,93 @@
+import collections
+import time
+
+from utilities.config_loader import config
+
+rest_headroom = config.get('REST_HEADROOM', 2)
+
+# (capacity, refill per second) of Discord's documented or observed limits, per channel
+ROUTE_LIMITS = {
+    "messages": (5, 1.0),
+    "reactions": (4, 4.0),
+    "typing": (5, 1.0),
+}
+GLOBAL_LIMIT = (50, 50.0)
+IDLE_BUCKETS = 5000
+
+
+class _Bucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def level(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+class RestBudget:
+    """
+    Local model of Discord's REST rate-limit buckets, used to keep cosmetic calls out of the way of replies.
+
+    discord.py already waits out real rate limits, but it does so for every call alike, so a
+    burst of reactions and typing indicators delays the replies sharing their buckets. This
+    keeps a token bucket per route and channel plus one for the global limit. Replies spend
+    tokens unconditionally through spend(); optional calls ask allow() first and are shed
+    when the call would leave less than REST_HEADROOM tokens for replies.
+    """
+
+    def __init__(self, headroom=rest_headroom):
+        self.headroom = headroom
+        self._buckets = collections.OrderedDict()
+        self._global = _Bucket(*GLOBAL_LIMIT)
+        self.spent = collections.Counter()
+        self.shed = collections.Counter()
+
+    def _bucket(self, route, channel_id):
+        key = (route, channel_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(*ROUTE_LIMITS[route])
+            if len(self._buckets) > IDLE_BUCKETS:
+                # Buckets of channels that have been quiet the longest are full again by now
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def spend(self, channel_id, route="messages"):
+        """Records an essential call (a reply), which always goes out."""
+        bucket = self._bucket(route, channel_id)
+        bucket.level()
+        self._global.level()
+        bucket.tokens -= 1
+        self._global.tokens -= 1
+        self.spent[route] += 1
+
+    def allow(self, channel_id, route, kind=None, cost=1):
+        """
+        Whether an optional call may go out now. Allowed calls are recorded as spent.
+
+        Args:
+            kind (str): Label for the shed metrics, defaults to the route.
+            cost (int): Number of calls that go out together or not at all.
+        """
+        bucket = self._bucket(route, channel_id)
+        # Optional calls on the reply route itself must leave room for the replies
+        headroom = self.headroom if route == "messages" else 0
+        if bucket.level() < cost + headroom or self._global.level() < cost + self.headroom:
+            self.shed[kind or route] += cost
+            return False
+        bucket.tokens -= cost
+        self._global.tokens -= cost
+        self.spent[route] += cost
+        return True
+
+    def status(self):
+        shed = ", ".join(f"{kind} {count}" for kind, count in self.shed.most_common()) or "none"
+        return f"{sum(self.spent.values())} calls made, shed: {shed}"
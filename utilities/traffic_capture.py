@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from utilities.config_loader import config
+
+capture_enabled = config.get('TRAFFIC_CAPTURE', False)
+capture_file = config.get('TRAFFIC_CAPTURE_FILE', 'traffic.jsonl')
+FLUSH_INTERVAL = 5
+# Events kept in memory while the file cannot be written, newer ones are dropped beyond this
+MAX_BUFFERED = 10000
+
+
+class TrafficRecorder:
+    """
+    Records the timing and shape of incoming traffic to a compact JSON lines file.
+
+    Nothing identifying is written: channel and author IDs are replaced with salted
+    hashes that change on every start, and message text is reduced to its length.
+    Each line holds the offset in seconds from the start of the capture ("t"), the
+    event kind ("k": "m" for messages, "c" for commands) and a few shape fields.
+
+    Events are buffered and appended every FLUSH_INTERVAL seconds off the event loop. A
+    failed write keeps the events for the next try, up to MAX_BUFFERED; beyond that new
+    events are counted as dropped instead of growing the buffer.
+    """
+
+    def __init__(self, path=capture_file, enabled=capture_enabled):
+        self.path = path
+        self.enabled = enabled
+        self._salt = os.urandom(16)
+        self._started = time.monotonic()
+        self._buffer = []
+        self._header_written = False
+        self._task = None
+        self.dropped = 0
+        self._reported_drops = 0
+
+    def _anonymize(self, value):
+        return hashlib.blake2b(str(value).encode(), key=self._salt, digest_size=4).hexdigest()
+
+    def _offset(self):
+        return round(time.monotonic() - self._started, 3)
+
+    def _record(self, event):
+        if len(self._buffer) >= MAX_BUFFERED:
+            self.dropped += 1
+            return
+        self._buffer.append(event)
+
+    def record_message(self, message, trigger):
+        if not self.enabled:
+            return
+        self._record({
+            "t": self._offset(),
+            "k": "m",
+            "c": self._anonymize(message.channel.id),
+            "u": self._anonymize(message.author.id),
+            "n": len(message.content),
+            "a": len(message.attachments),
+            "g": trigger,
+        })
+
+    def record_command(self, ctx):
+        if not self.enabled:
+            return
+        self._record({
+            "t": self._offset(),
+            "k": "c",
+            "c": self._anonymize(ctx.channel.id),
+            "u": self._anonymize(ctx.author.id),
+            "x": ctx.command.qualified_name,
+        })
+
+    def _write(self, events):
+        with open(self.path, "a", encoding="utf-8") as f:
+            if not self._header_written:
+                # Every bot start begins a new session whose offsets restart at zero
+                f.write(json.dumps({"v": 1, "started": time.time()}) + "\n")
+                self._header_written = True
+            for event in events:
+                f.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        events, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, events)
+        except BaseException:
+            # Kept for the next flush, newer events recorded meanwhile go after them
+            self._buffer = (events + self._buffer)[:MAX_BUFFERED]
+            raise
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except OSError as e:
+                print(f"\033[33mCould not write traffic capture to {self.path}: {e!r}\033[0m")
+            if self.dropped > self._reported_drops:
+                self._reported_drops = self.dropped
+                print(f"\033[33mTraffic capture buffer is full, {self.dropped} events dropped so far\033[0m")
+
+    def close(self):
+        """Writes what is still buffered, call it once the event loop has stopped."""
+        if self._buffer:
+            events, self._buffer = self._buffer, []
+            try:
+                self._write(events)
+            except OSError as e:
+                print(f"\033[33mCould not write traffic capture to {self.path}: {e!r}\033[0m")
+
+    def start(self):
+        if self.enabled and self._task is None:
+            print(f"\033[33mTraffic capture is on, writing to {self.path}\033[0m")
+            self._task = asyncio.create_task(self._flush_periodically())
+
+
+def load_trace(path):
+    """Reads a capture file and returns its events, with later sessions shifted to follow earlier ones."""
+    events = []
+    session_base = 0.0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "k" not in entry:
+                session_base = events[-1]["t"] if events else 0.0
+                continue
+            entry["t"] += session_base
+            events.append(entry)
+    return events